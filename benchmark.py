@@ -0,0 +1,286 @@
+# coding=utf-8
+import sys
+import os
+import argparse
+import glob
+import json
+import platform
+import random
+import resource
+import time
+import cProfile
+import multiprocessing
+import numpy as np
+import scipy
+import sklearn
+import etym_classifier_utils as utils
+import etym_store
+import language_registry
+import scrape_etymologies
+
+# tracemalloc is only in Python 3 (or a patched Python 2), so where it's missing the peak resident memory of the process is reported instead
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+
+# the stages that are run once, on the bundled data and the saved fixture pages
+SHARED_STAGES = ["build_etym_dict", "load_etym_dict", "get_ordered_languages", "compile_language_table", "get_lem", "lemmatize_content",
+	"parse_entries", "parse_etym_paragraph", "remove_in_paren"]
+# the stages that are run on the rotten_imdb data and on each synthetic corpus made from it
+SCALED_STAGES = ["tokenize_content", "compile_token_table", "get_vectors", "get_feature_matrices", "generate_folds", "get_data_for_fold", "classify_svm", "classify_sgd"]
+
+
+# function that returns the peak resident memory of the process so far, in megabytes
+def peak_rss_mb():
+	# linux reports ru_maxrss in kilobytes (mac os in bytes)
+	if sys.platform == "darwin":
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0)
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+# runs the stages of the benchmark and collects their timings
+# each stage is timed repeat times (keeping the fastest, which is the least disturbed by everything else on the machine),
+# and can also be profiled with cProfile into profile_dir/<stage>.prof (readable with pstats)
+class Benchmark(object):
+	def __init__(self, stages=None, repeat=3, profile_dir=None, trace_memory=False):
+		self.stages = stages
+		self.repeat = repeat
+		self.profile_dir = profile_dir
+		self.trace_memory = trace_memory and tracemalloc is not None
+		self.results = []
+		if profile_dir is not None and not os.path.isdir(profile_dir):
+			os.makedirs(profile_dir)
+
+	def wanted(self, name):
+		return self.stages is None or name in self.stages
+
+	# function that times function(*args), recording the stage under name (and scale), and returns what the function returned
+	# items is how many things (lines, words, pages...) the stage handles, so the throughput can be compared across scales
+	def run(self, name, function, args=(), items=None, scale=None, repeat=None):
+		if repeat is None:
+			repeat = self.repeat
+		times = []
+		for attempt in range(repeat):
+			if self.trace_memory:
+				tracemalloc.start()
+			start_time = time.time()
+			result = function(*args)
+			times.append(time.time() - start_time)
+			if self.trace_memory:
+				traced_peak = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+				tracemalloc.stop()
+		if self.profile_dir is not None:
+			profile_name = name if scale is None else "%s-%sx" % (name, scale)
+			profiler = cProfile.Profile()
+			profiler.runcall(function, *args)
+			profiler.dump_stats(os.path.join(self.profile_dir, profile_name + ".prof"))
+		stage = {"stage": name, "seconds": min(times), "times": times, "peak_rss_mb": peak_rss_mb()}
+		if scale is not None:
+			stage["scale"] = scale
+		if items is not None:
+			stage["items"] = items
+			stage["items_per_second"] = items / min(times) if min(times) > 0 else None
+		if self.trace_memory:
+			stage["traced_peak_mb"] = traced_peak
+		self.results.append(stage)
+		print "%-24s %-6s %10.4f s%s" % (name, "" if scale is None else "%sx" % scale, min(times),
+			"" if items is None else "  (%d items, %.0f per second)" % (items, stage["items_per_second"] or 0))
+		return result
+
+	# function that records a stage that wasn't run, and why
+	def skip(self, name, reason, scale=None):
+		stage = {"stage": name, "skipped": reason}
+		if scale is not None:
+			stage["scale"] = scale
+		self.results.append(stage)
+		print "%-24s %-6s skipped: %s" % (name, "" if scale is None else "%sx" % scale, reason)
+
+
+# function that makes a synthetic corpus num_lines lines long from the lines of a real one
+# each line has the length of a random real line, with words drawn from the real corpus's word frequencies, so the vocabulary and
+# the number of words per line stay realistic while the corpus grows
+def make_synthetic_corpus(content, num_lines, seed=0):
+	random_state = random.Random(seed)
+	lines = [line.split() for line in content]
+	words = [word for line in lines for word in line]
+	synthetic = []
+	for i in xrange(num_lines):
+		length = len(random_state.choice(lines))
+		synthetic.append(" ".join(random_state.choice(words) for j in xrange(length)) + "\n")
+	return synthetic
+
+
+# function that returns the etymology paragraphs of the fixture pages (the html of each entry's p[2], as parse_entries sees them)
+def get_fixture_paragraphs(pages):
+	import lxml.html
+	import lxml.etree
+	paragraphs = []
+	for html in pages:
+		doc = lxml.html.fromstring(html)
+		for entry in doc.xpath("//section[@class = 'word__defination--2q7ZH']/object/p[2]"):
+			paragraphs.append(lxml.etree.tostring(entry))
+	return paragraphs
+
+
+# function that runs the stages that don't depend on the size of the corpus
+# returns the ordered languages and language table, which the scaled stages use
+def run_shared_stages(benchmark, etym_file, fixture_dir, content, lem_words):
+	list_of_languages = utils.read_list_of_languages(os.getcwd() + "/list_of_languages.txt")
+	if benchmark.wanted("build_etym_dict"):
+		etym_dict = benchmark.run("build_etym_dict", utils.build_etym_dict, (etym_file,))
+	else:
+		etym_dict = utils.build_etym_dict(etym_file)
+	if benchmark.wanted("load_etym_dict"):
+		benchmark.run("load_etym_dict", etym_store.load_etym_dict, (etym_file,))
+	ordered_languages = language_registry.load_ordered_languages(etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages, etym_file=etym_file)
+	if benchmark.wanted("get_ordered_languages"):
+		benchmark.run("get_ordered_languages", utils.get_ordered_languages, (etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages), len(etym_dict))
+	language_table = utils.compile_language_table(etym_dict, ordered_languages, utils.ACCEPTABLE_MODIFIERS, list_of_languages)
+	if benchmark.wanted("compile_language_table"):
+		benchmark.run("compile_language_table", utils.compile_language_table, (etym_dict, ordered_languages, utils.ACCEPTABLE_MODIFIERS, list_of_languages), len(etym_dict))
+	# get_lem tags every word on its own, so it's timed on a sample of the distinct words
+	tokenized_content = utils.tokenize_content(content)
+	distinct_words = sorted(set(word for tokens in tokenized_content if tokens is not None for word in tokens))
+	sample = random.Random(0).sample(distinct_words, min(lem_words, len(distinct_words)))
+	if benchmark.wanted("get_lem"):
+		benchmark.run("get_lem", lambda words: [utils.get_lem(word) for word in words], (sample,), len(sample), repeat=1)
+	if benchmark.wanted("lemmatize_content"):
+		benchmark.run("lemmatize_content", utils.lemmatize_content, (tokenized_content,), sum(len(tokens) for tokens in tokenized_content if tokens is not None))
+	pages = [open(page).read() for page in sorted(glob.glob(os.path.join(fixture_dir, "*.html")))]
+	if not pages:
+		for name in ["parse_entries", "parse_etym_paragraph", "remove_in_paren"]:
+			if benchmark.wanted(name):
+				benchmark.skip(name, "no fixture pages in %s" % fixture_dir)
+		return ordered_languages, language_table
+	paragraphs = get_fixture_paragraphs(pages)
+	# the fixture pages are small, so each stage goes through them many times to get a measurable time
+	rounds = 200
+	if benchmark.wanted("parse_entries"):
+		benchmark.run("parse_entries", lambda: [scrape_etymologies.parse_entries(html) for r in xrange(rounds) for html in pages], (), rounds * len(pages))
+	if benchmark.wanted("parse_etym_paragraph"):
+		benchmark.run("parse_etym_paragraph", lambda: [scrape_etymologies.parse_etym_paragraph(paragraph) for r in xrange(rounds) for paragraph in paragraphs], (), rounds * len(paragraphs))
+	if benchmark.wanted("remove_in_paren"):
+		benchmark.run("remove_in_paren", lambda: [scrape_etymologies.remove_in_paren(paragraph) for r in xrange(rounds) for paragraph in paragraphs], (), rounds * len(paragraphs))
+	return ordered_languages, language_table
+
+
+# function that runs the stages that depend on the size of the corpus, on the subjective and objective lines (labelled 1 and 0)
+# the kernel svm's training time grows with the square of the number of examples, so it's skipped for corpora with more than svm_max_rows rows
+def run_scaled_stages(benchmark, scale, subjective_content, objective_content, ordered_languages, language_table, stop_words, svm_max_rows):
+	content = subjective_content + objective_content
+	num_lines = len(content)
+	if benchmark.wanted("tokenize_content"):
+		tokenized_content = benchmark.run("tokenize_content", utils.tokenize_content, (content,), num_lines, scale, repeat=1)
+	else:
+		tokenized_content = utils.tokenize_content(content)
+	num_tokens = sum(len(tokens) for tokens in tokenized_content if tokens is not None)
+	if benchmark.wanted("compile_token_table"):
+		token_table = benchmark.run("compile_token_table", utils.compile_token_table, (tokenized_content, language_table), num_tokens, scale, repeat=1)
+	else:
+		token_table = utils.compile_token_table(tokenized_content, language_table)
+	if benchmark.wanted("get_vectors"):
+		benchmark.run("get_vectors", utils.get_vectors, (tokenized_content, token_table, ordered_languages, True, stop_words, "count"), num_lines, scale)
+	if benchmark.wanted("get_feature_matrices"):
+		matrices = benchmark.run("get_feature_matrices", utils.get_feature_matrices, (tokenized_content, token_table, ordered_languages, stop_words), num_lines, scale)
+	else:
+		matrices = utils.get_feature_matrices(tokenized_content, token_table, ordered_languages, stop_words)
+	data = matrices[(True, "count")][1]
+	num_subjective = len([tokens for tokens in tokenized_content[:len(subjective_content)] if tokens is not None])
+	labels = np.concatenate((np.ones(num_subjective, dtype=int), np.zeros(data.shape[0] - num_subjective, dtype=int)))
+	if benchmark.wanted("generate_folds"):
+		folds = benchmark.run("generate_folds", utils.generate_folds, (len(labels), 10, 0, labels), len(labels), scale)
+	else:
+		folds = utils.generate_folds(len(labels), 10, 0, labels)
+	if benchmark.wanted("get_data_for_fold"):
+		benchmark.run("get_data_for_fold", lambda: [utils.get_data_for_fold(fold, data, labels) for fold in folds], (), len(labels), scale)
+	training_data, training_labels, testing_data, testing_labels = utils.get_data_for_fold(folds[0], data, labels)
+	if benchmark.wanted("classify_svm"):
+		if data.shape[0] > svm_max_rows:
+			benchmark.skip("classify_svm", "%d rows is more than --svm-max-rows %d" % (data.shape[0], svm_max_rows), scale)
+		else:
+			benchmark.run("classify_svm", utils.classify_svm, (training_data, training_labels, testing_data), data.shape[0], scale, repeat=1)
+	if benchmark.wanted("classify_sgd"):
+		benchmark.run("classify_sgd", utils.classify, (training_data, training_labels, testing_data, "sgd"), data.shape[0], scale, repeat=1)
+
+
+# function that compares the results of a run with a baseline run (both as written by this file)
+# returns the stages that took more than (1 + tolerance) times as long as they did in the baseline
+def find_regressions(results, baseline, tolerance):
+	baseline_seconds = dict(((stage["stage"], stage.get("scale")), stage["seconds"]) for stage in baseline["stages"] if "seconds" in stage)
+	regressions = []
+	for stage in results["stages"]:
+		key = (stage["stage"], stage.get("scale"))
+		if "seconds" in stage and key in baseline_seconds and baseline_seconds[key] > 0:
+			ratio = stage["seconds"] / baseline_seconds[key]
+			if ratio > 1 + tolerance:
+				regressions.append((key, baseline_seconds[key], stage["seconds"], ratio))
+	return regressions
+
+
+# this file should be called from the command line as follows:
+# python benchmark.py [--output results.json] [--scales 1,10,100] [--stages a,b,...] [--repeat N] [--profile-dir DIR] [--trace-memory]
+#   [--baseline old_results.json] [--tolerance T]
+# it times each stage of scraping, vectorizing and cross validation separately on the rotten_imdb data, the saved fixture pages in fixtures/etymonline,
+# and synthetic corpora scales times the size of rotten_imdb, and writes the timings (with the peak memory after each stage) as json
+# with --baseline, the stages that got more than tolerance (a fraction) slower than in the baseline are listed and the exit status is 1
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--output", default=None, help="json file to write the results to")
+	parser.add_argument("--scales", default="1,10,100", help="comma separated sizes of the corpora, as multiples of rotten_imdb (1 is the real data)")
+	parser.add_argument("--stages", default=None, help="comma separated stages to run (from %s)" % ", ".join(SHARED_STAGES + SCALED_STAGES))
+	parser.add_argument("--repeat", type=int, default=3, help="times to run each quick stage (the fastest time is kept)")
+	parser.add_argument("--lem-words", type=int, default=500, help="number of distinct words to time get_lem on")
+	parser.add_argument("--svm-max-rows", type=int, default=20000, help="skip the kernel svm for corpora bigger than this")
+	parser.add_argument("--profile-dir", default=None, help="write a cProfile dump of every stage to this directory")
+	parser.add_argument("--trace-memory", action="store_true", help="also record the peak traced allocations of every stage (needs tracemalloc)")
+	parser.add_argument("--baseline", default=None, help="json results of an earlier run to compare with")
+	parser.add_argument("--tolerance", type=float, default=0.2, help="how much slower than the baseline a stage can get before it counts as a regression")
+	args = parser.parse_args()
+	if args.trace_memory and tracemalloc is None:
+		print "tracemalloc isn't available in this Python, so only the peak resident memory is recorded"
+
+	from nltk.corpus import stopwords
+	stop_words = set(stopwords.words('english'))
+	subjective_content = open(os.getcwd() + "/rotten_imdb/quote.tok.gt9.5000").readlines()
+	objective_content = open(os.getcwd() + "/rotten_imdb/plot.tok.gt9.5000").readlines()
+	stages = args.stages.split(",") if args.stages else None
+	benchmark = Benchmark(stages, args.repeat, args.profile_dir, args.trace_memory)
+
+	ordered_languages, language_table = run_shared_stages(benchmark, "scraped_etymologies.txt", os.getcwd() + "/fixtures/etymonline",
+		subjective_content + objective_content, args.lem_words)
+	scales = [int(scale) for scale in args.scales.split(",")]
+	for scale in scales:
+		if scale == 1:
+			scaled_subjective, scaled_objective = subjective_content, objective_content
+		else:
+			scaled_subjective = make_synthetic_corpus(subjective_content, scale * len(subjective_content), seed=scale)
+			scaled_objective = make_synthetic_corpus(objective_content, scale * len(objective_content), seed=-scale)
+		run_scaled_stages(benchmark, scale, scaled_subjective, scaled_objective, ordered_languages, language_table, stop_words, args.svm_max_rows)
+
+	results = {
+		"environment": {
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"scipy": scipy.__version__,
+			"sklearn": sklearn.__version__,
+			"platform": platform.platform(),
+			"cpu_count": multiprocessing.cpu_count(),
+			"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		},
+		"scales": scales,
+		"memory": "tracemalloc" if benchmark.trace_memory else "peak resident memory",
+		"stages": benchmark.results,
+	}
+	if args.output:
+		with open(args.output, "w") as output:
+			json.dump(results, output, indent=1)
+		print "Wrote the results to %s" % args.output
+	if args.baseline:
+		regressions = find_regressions(results, json.load(open(args.baseline)), args.tolerance)
+		for (name, scale), before, after, ratio in regressions:
+			print "regression: %s%s took %.4f s, %.2f times the baseline's %.4f s" % (name, "" if scale is None else " (%sx)" % scale, after, ratio, before)
+		if regressions:
+			sys.exit(1)
+		print "No stage is more than %d%% slower than the baseline" % (100 * args.tolerance)
@@ -0,0 +1,67 @@
+# coding=utf-8
+import sys
+import os
+import argparse
+import multiprocessing
+import time
+import numpy as np
+from scipy import sparse
+from nltk.corpus import stopwords
+import etym_classifier_utils as utils
+import etym_store
+import language_registry
+
+
+# function that vectorizes both classes with one of the lemmatization paths and returns the seconds spent lemmatizing
+# and the (include stopwords, count, all languages) feature matrix of the subjective examples stacked on the objective ones
+def vectorize_with(path, subjective_tokens, objective_tokens, language_table, ordered_languages, stop_words):
+	start_time = time.time()
+	if path == "sentence":
+		subjective_lemmas = utils.lemmatize_content(subjective_tokens)
+		objective_lemmas = utils.lemmatize_content(objective_tokens)
+		token_table = language_table
+	else:
+		subjective_lemmas = None
+		objective_lemmas = None
+		token_table = utils.compile_token_table(subjective_tokens + objective_tokens, language_table)
+	seconds = time.time() - start_time
+	subjective_data = utils.get_feature_matrices(subjective_tokens, token_table, ordered_languages, stop_words, subjective_lemmas)[(True, "count")][1]
+	objective_data = utils.get_feature_matrices(objective_tokens, token_table, ordered_languages, stop_words, objective_lemmas)[(True, "count")][1]
+	return seconds, sparse.vstack((subjective_data, objective_data), format="csr")
+
+
+# this file should be called from the command line as follows:
+# python benchmark_lemmatization.py [--lines N] [--processes N] [--seed S] [--backend B]
+# it lemmatizes the rotten_imdb data by tagging each word on its own (get_lem) and by tagging whole sentences at once (lemmatize_content),
+# and prints the time each took along with the mean 10-fold F1 score of the best variation (stopwords included, counts of all languages) for each
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--lines", type=int, default=None, help="only use the first N lines of each class")
+	parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--backend", default="svm", choices=utils.CLASSIFIER_BACKENDS)
+	args = parser.parse_args()
+
+	subjective_content = open(os.getcwd() + "/rotten_imdb/quote.tok.gt9.5000").readlines()[:args.lines]
+	objective_content = open(os.getcwd() + "/rotten_imdb/plot.tok.gt9.5000").readlines()[:args.lines]
+	stop_words = set(stopwords.words('english'))
+	etym_dict = etym_store.load_etym_dict("scraped_etymologies.txt")
+	list_of_languages = utils.read_list_of_languages(os.getcwd() + "/list_of_languages.txt")
+	ordered_languages = language_registry.load_ordered_languages(etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages)
+	language_table = utils.compile_language_table(etym_dict, ordered_languages, utils.ACCEPTABLE_MODIFIERS, list_of_languages)
+	subjective_tokens = utils.tokenize_content(subjective_content)
+	objective_tokens = utils.tokenize_content(objective_content)
+	num_tokens = sum(len(tokens) for tokens in subjective_tokens + objective_tokens if tokens is not None)
+
+	results = []
+	for path in ["word", "sentence"]:
+		seconds, data = vectorize_with(path, subjective_tokens, objective_tokens, language_table, ordered_languages, stop_words)
+		num_subjective = len([tokens for tokens in subjective_tokens if tokens is not None])
+		labels = np.concatenate((np.ones(num_subjective, dtype=int), np.zeros(data.shape[0] - num_subjective, dtype=int)))
+		folds = utils.generate_folds(len(labels), 10, args.seed, labels)
+		scores = utils.run_cross_validation([data], labels, folds, args.processes, [args.backend])[0][0]
+		results.append((path, seconds, np.mean([f1 for f1, fit_seconds in scores])))
+
+	print "%d lines, %d tokens" % (len(subjective_tokens) + len(objective_tokens), num_tokens)
+	for path, seconds, f1 in results:
+		print "%s-level tagging: %.2f seconds (%.0f tokens per second), mean f1_score (%s): %.3f" % (path, seconds, num_tokens / seconds if seconds > 0 else 0.0, args.backend, f1)
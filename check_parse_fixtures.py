@@ -0,0 +1,51 @@
+# coding=utf-8
+import sys
+import os
+import glob
+import json
+import scrape_etymologies
+
+
+# function that returns the entries parse_entries finds in a saved page, in the form they're stored in the expected output
+# (a list of [linked roots, languages] for each entry, as it reads back from json)
+def parse_fixture(page_file):
+	return json.loads(json.dumps(scrape_etymologies.parse_entries(open(page_file).read())))
+
+
+# function that returns a line for each difference between the expected and parsed entries of a page
+def diff_entries(expected, parsed):
+	differences = []
+	if len(expected) != len(parsed):
+		differences.append("expected %d entries, parsed %d" % (len(expected), len(parsed)))
+	for i, (expected_entry, parsed_entry) in enumerate(zip(expected, parsed)):
+		for name, expected_part, parsed_part in zip(["linked roots", "languages"], expected_entry, parsed_entry):
+			if expected_part != parsed_part:
+				differences.append("entry %d %s: expected %s, parsed %s" % (i, name, json.dumps(expected_part), json.dumps(parsed_part)))
+	return differences
+
+
+# this file should be called from the command line as follows:
+# python check_parse_fixtures.py [<fixture_dir>]
+# it parses each saved page in fixture_dir (fixtures/etymonline by default) with parse_entries and compares the entries with the page's
+# <word>.expected.json, which holds the entries the parser found before it walked the element tree (when it serialized each entry and
+# parsed the html text with regular expressions), so changes to the parser can be checked against the pages it has to handle
+# it prints the differences for each page and exits with status 1 if any page doesn't match
+if __name__ == "__main__":
+	fixture_dir = sys.argv[1] if len(sys.argv) > 1 else "fixtures/etymonline"
+	failed_pages = []
+	for page_file in sorted(glob.glob(os.path.join(fixture_dir, "*.html"))):
+		expected_file = os.path.splitext(page_file)[0] + ".expected.json"
+		if not os.path.exists(expected_file):
+			print "MISSING: %s has no %s" % (page_file, os.path.basename(expected_file))
+			failed_pages.append(page_file)
+			continue
+		differences = diff_entries(json.load(open(expected_file)), parse_fixture(page_file))
+		print "%s: %s" % ("ok" if not differences else "FAILED", page_file)
+		for difference in differences:
+			print "\t" + difference
+		if differences:
+			failed_pages.append(page_file)
+	if failed_pages:
+		print "%d pages failed" % len(failed_pages)
+		sys.exit(1)
+	print "all pages matched"
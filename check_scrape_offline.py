@@ -0,0 +1,95 @@
+# coding=utf-8
+import sys
+import os
+import glob
+import shutil
+import tempfile
+import threading
+import scrape_engine
+import scrape_etymologies
+
+
+# function that scrapes words against the fixture server the way scrape_etymologies.py does (without the lemmatization, which needs wordnet)
+# returns (results, fetcher, resolver)
+def scrape(words, base_url, cache_dir, journal_file, max_retries):
+	fetcher = scrape_engine.Fetcher(scrape_engine.HttpCache(cache_dir), max_retries=max_retries, backoff=0.01, timeout=5)
+	resolver = scrape_etymologies.EtymResolver(fetcher, base_url)
+
+	def scrape_word(word):
+		etym = resolver.resolve(word)
+		if etym is None:
+			return False
+		return list(etym)
+
+	journal = scrape_engine.Journal(journal_file)
+	results = dict(scrape_engine.run_scrape(words, scrape_word, journal, num_workers=4))
+	journal.close()
+	return results, fetcher, resolver
+
+
+# function that sets how many times each page fails before it's served, starting the count of requests over
+# (the server is kept for the whole check, since the cached pages are looked up by url, which includes the server's port)
+def set_failures(server, failures):
+	server.RequestHandlerClass.failures = failures
+	server.RequestHandlerClass.request_counts.clear()
+
+
+# this file should be called from the command line as follows:
+# python check_scrape_offline.py [<fixture_dir>]
+# it runs the scraper (run_scrape with the etymology resolver) against a local server of the saved pages in fixture_dir (fixtures/etymonline by default)
+# and checks that failed requests are retried, that every word is recorded in the journal, that a rerun with the same journal scrapes nothing,
+# that a rerun with a new journal is served entirely from the cache with the same results, and that words whose pages can't be fetched
+# are left out of the journal so they're retried
+# it prints each check and exits with status 1 if any of them failed
+if __name__ == "__main__":
+	fixture_dir = sys.argv[1] if len(sys.argv) > 1 else "fixtures/etymonline"
+	fixture_words = sorted(os.path.splitext(os.path.basename(page))[0] for page in glob.glob(os.path.join(fixture_dir, "*.html")))
+	# a word without a page, which should be recorded as having no etymology
+	words = fixture_words + ["notaword"]
+	work_dir = tempfile.mkdtemp(prefix="check_scrape_offline")
+	failed_checks = []
+
+	def check(condition, description):
+		print "%s: %s" % ("ok" if condition else "FAILED", description)
+		if not condition:
+			failed_checks.append(description)
+
+	try:
+		cache_dir = os.path.join(work_dir, "cache")
+		journal_file = os.path.join(work_dir, "scrape.journal")
+		server = scrape_engine.make_fixture_server(fixture_dir)
+		thread = threading.Thread(target=server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		base_url = "http://127.0.0.1:%d/word/%%s" % server.server_address[1]
+		# every page fails once before it's served, so each of them has to be retried
+		set_failures(server, 1)
+		results, fetcher, resolver = scrape(words, base_url, cache_dir, journal_file, 2)
+		check(sorted(results) == sorted(words), "every word is in the journal")
+		check(results["notaword"] is False, "a word without a page has no etymology")
+		check(all(results[word] for word in fixture_words), "every fixture word has an etymology")
+		pages = [word for word, page in resolver.pages.items() if page is not None]
+		missing_pages = [word for word, page in resolver.pages.items() if page is None]
+		# each page that exists is requested twice (the failure and the retry), and each missing page twice (the failure and the 404)
+		check(fetcher.requests == 2 * (len(pages) + len(missing_pages)), "failed requests are retried once (%d requests for %d pages)" % (fetcher.requests, len(resolver.pages)))
+		check(fetcher.cache_hits == 0, "nothing is served from an empty cache")
+
+		set_failures(server, 0)
+		rerun_results, fetcher, resolver = scrape(words, base_url, cache_dir, journal_file, 2)
+		check(rerun_results == results and fetcher.requests == 0 and fetcher.cache_hits == 0, "a rerun with the same journal scrapes nothing")
+		rerun_results, fetcher, resolver = scrape(words, base_url, cache_dir, os.path.join(work_dir, "new.journal"), 2)
+		check(rerun_results == results, "a rerun with a new journal gives the same results")
+		check(fetcher.requests == 0 and fetcher.cache_hits == len(resolver.pages), "a rerun with a new journal is served from the cache (%d requests, %d cache hits)" % (fetcher.requests, fetcher.cache_hits))
+
+		# pages that fail more times than the fetcher retries can't be fetched, so their words are deferred to the next run
+		set_failures(server, 5)
+		failed_results, fetcher, resolver = scrape(fixture_words, base_url, os.path.join(work_dir, "failing_cache"), os.path.join(work_dir, "failing.journal"), 1)
+		check(len(failed_results) == 0, "words whose pages can't be fetched are left out of the journal")
+		check(fetcher.requests >= 2 * len(fixture_words) and os.listdir(os.path.join(work_dir, "failing_cache", "urls")) == [], "failed pages are retried and never cached")
+		server.shutdown()
+	finally:
+		shutil.rmtree(work_dir)
+	if failed_checks:
+		print "%d checks failed" % len(failed_checks)
+		sys.exit(1)
+	print "all checks passed"
@@ -1,11 +1,25 @@
 # coding=utf-8
+import collections
 import numpy as np
 import sklearn
-from sklearn import svm
+from scipy import sparse
+from sklearn import svm, metrics, linear_model, kernel_approximation
 from nltk import word_tokenize, pos_tag
 from nltk.stem.wordnet import WordNetLemmatizer
-import random
+from nltk.tag.perceptron import PerceptronTagger
+from language_normalizer import LanguageNormalizer
+import multiprocessing
+import time
+import instrumentation
 
+instrumentation.describe("lines_tokenized_total", "Lines that were tokenized")
+instrumentation.describe("lines_skipped_total", "Lines that were skipped because they couldn't be tokenized or vectorized")
+instrumentation.describe("tokens_processed_total", "Tokens looked up in the token table or language table")
+instrumentation.describe("dictionary_hits_total", "Tokens that had an etymology")
+instrumentation.describe("dictionary_misses_total", "Tokens that didn't have an etymology")
+instrumentation.describe("lemmatize_errors_total", "Words that couldn't be tagged or lemmatized")
+instrumentation.describe("fold_seconds", "Time to fit and predict one cross validation fold", [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600])
+instrumentation.describe("fold_f1_score", "F1 score of each cross validation fold", [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
 
 # function that reads the contents of a file containing the etymologies of desired words and builds a dictionary
 # in which the keys are the words and the etymologies are the values
@@ -25,7 +39,7 @@ def build_etym_dict(etym_file):
 		for lang in etym.split(','):
 			# strip any leading or trailing spaces and add it to curr_etym
 			curr_etym.append(lang.strip())
-		# none of the words in our etym_file are in there twice so we can just add them to the dictionary
+		# a word that's in the file twice (because a rescraped entry was appended, see language_registry.py) keeps its last entry
 		etym_dict[word] = curr_etym
 	return etym_dict
 
@@ -43,6 +57,72 @@ def get_lem(word):
 		return str(lemmatizer.lemmatize(pos[0])), pos[1][0].lower()
 
 
+# the tagger and lemmatizer used by lemmatize_content, made the first time they're needed
+# nltk's pos_tag loads the tagger's model again on every call, which costs far more than tagging a sentence, so one tagger is kept for the whole run
+tagger = None
+lemmatizer = None
+
+
+# function that returns the part of speech tagger shared by every call to lemmatize_content
+def get_tagger():
+	global tagger
+	if tagger is None:
+		tagger = PerceptronTagger()
+	return tagger
+
+
+# function that lemmatizes a word given its part of speech tag, the same way get_lem does
+# lemmas is a dictionary of the (word, part of speech) pairs that have already been lemmatized, since the lemmatizer is slow and the same pairs come up over and over
+def lemmatize_tagged(word, tag, lemmas):
+	global lemmatizer
+	pos = tag[0].lower()
+	if (word, pos) not in lemmas:
+		if lemmatizer is None:
+			lemmatizer = WordNetLemmatizer()
+		try:
+			# if the part of speech is an adjective, noun, or verb, then pass lemmatizer the part of speech for increased accuracy
+			if pos in ['a','n','v']:
+				lemmas[(word, pos)] = str(lemmatizer.lemmatize(word, pos))
+			else:
+				lemmas[(word, pos)] = str(lemmatizer.lemmatize(word))
+		except Exception as e:
+			# print e
+			instrumentation.increment("lemmatize_errors_total")
+			lemmas[(word, pos)] = None
+	return lemmas[(word, pos)]
+
+
+# function that lemmatizes every token of the tokenized data using the part of speech it has in its sentence
+# rather than tagging each word on its own like get_lem, whole lines are tagged together, batch_size lines per call to the tagger,
+# so the tagger sees each word in context and a corpus only takes a few passes
+# it returns a list with the list of lemmas of each line (one per token, None for a token that couldn't be lemmatized), or None for a line that couldn't be tokenized,
+# which can be passed to get_vectors or get_feature_matrices along with the language table (which is keyed by lemma) in place of a token table
+def lemmatize_content(tokenized_content, batch_size=1000):
+	lines = [tokens for tokens in tokenized_content if tokens is not None]
+	tagged_lines = []
+	for start in range(0, len(lines), batch_size):
+		batch = lines[start:start + batch_size]
+		try:
+			tagged_lines.extend(get_tagger().tag_sents(batch))
+		except Exception as e:
+			# tag the lines of the batch one at a time, so that one bad line doesn't lose the whole batch
+			for tokens in batch:
+				try:
+					tagged_lines.append(get_tagger().tag(tokens))
+				except Exception as e:
+					instrumentation.increment("lemmatize_errors_total", len(tokens))
+					tagged_lines.append([(word, "") for word in tokens])
+	lemmas = {}
+	lemmatized_content = []
+	tagged_lines = iter(tagged_lines)
+	for tokens in tokenized_content:
+		if tokens is None:
+			lemmatized_content.append(None)
+			continue
+		lemmatized_content.append([lemmatize_tagged(word, tag, lemmas) if tag else None for word, tag in next(tagged_lines)])
+	return lemmatized_content
+
+
 # function that creates a dictionary of all of the languages in a given dictionary of etymologies
 # in the resulting dictionary, the languages present are the keys and the counts of those languages are the values
 # sometimes non-languages or unwanted modifiers are present, so this needs to be cleaned
@@ -60,26 +140,21 @@ def get_list_of_languages(etym_dict):
 
 
 # function to remove any words in the entry that aren't languages or acceptable modifiers
-# it is used as part of the get_cleaned_languages function
 # it takes in one phrase of an entry and returns a string of that phrase with any words that aren't languages or acceptable modifiers removed
+# words with "Proto" in them are kept too, because sometimes languages are listed as, for example "Proto-Germanic", such that "proto" isn't an individual word
+# to clean many phrases, make one LanguageNormalizer and use it for all of them (this compiles the lists again on every call)
 def clean_entry(lang_entry, acceptable_modifiers, list_of_languages):
-	cleaned = ""
-	for word in word_tokenize(lang_entry):
-		# special check for "proto" because sometimes languages are listed as, for example "Proto-Germanic", such that "proto" isn't an individual word
-		if (word in acceptable_modifiers) or (word in list_of_languages) or ("Proto" in word):
-			cleaned += word + " "
-	# remove the extra space at the end
-	cleaned = cleaned.strip()
-	return cleaned
+	return LanguageNormalizer(acceptable_modifiers, list_of_languages).normalize(lang_entry)
 
 
 # function that takes in a language dictionary along with a list of acceptable modifiers
 # and returns a dictionary containing only the languages in the original language dictionary that exist (with acceptable modifiers) in the list of languages
 def get_cleaned_languages(languages_dict, acceptable_modifiers, list_of_languages):
+	normalizer = LanguageNormalizer(acceptable_modifiers, list_of_languages)
 	cleaned_languages = {}
 	for lang, count in languages_dict.items():
 		# clean the language entry
-		curr = clean_entry(lang, acceptable_modifiers, list_of_languages)
+		curr = normalizer.normalize(lang)
 		# add this cleaned language (and its count) to the dictionary
 		# in the cases where a cleaned entry results in a language in the dictionary (e.g., when "West Germanic" is cleaned to "Germanic"), add to the count
 		if curr != "":
@@ -90,111 +165,313 @@ def get_cleaned_languages(languages_dict, acceptable_modifiers, list_of_language
 	return cleaned_languages
 
 
-# function that takes in a given example from the data and an ordered list of the languages in the corpus, and finds the langauges present in that example
+# the language modifiers that are acceptable in a cleaned language
+ACCEPTABLE_MODIFIERS = ["Proto", "Old", "Middle", "High", "Low", "Late", "Medieval", "Modern", "Anglo-French", "American", "Canadian"]
+# languages that show up in the etymologies but aren't in the wiktionary list of languages
+OTHER_LANGUAGES = ["PIE", "Germanic", "Norse", "Etruscan", "Gaelic", "Italic", "Gaulish"]
+
+
+# function that reads in a list of possible languages (from wiktionary), with one language per line, and adds OTHER_LANGUAGES to it
+def read_list_of_languages(languages_file):
+	list_of_languages = []
+	with open(languages_file) as list_of_languages_file:
+		content = list_of_languages_file.readlines()
+		for line in content:
+			list_of_languages.append(line.rstrip())
+	list_of_languages += OTHER_LANGUAGES
+	return list_of_languages
+
+
+# function that finds the cleaned languages in an etymology dictionary and puts them in alphabetical order
+# the position of a language in the returned ordered dictionary (whose values are the counts of the languages) is its index in the vectors
+def get_ordered_languages(etym_dict, acceptable_modifiers, list_of_languages):
+	all_languages = get_list_of_languages(etym_dict)
+	cleaned_languages = get_cleaned_languages(all_languages, acceptable_modifiers, list_of_languages)
+	return collections.OrderedDict(sorted(cleaned_languages.items(), key=lambda t: t[0]))
+
+
+# function that tokenizes every line of the data once so that the tokens can be reused by the later stages
+# it returns a list containing the list of tokens for each line, or None for a line that couldn't be tokenized (these lines are skipped when vectorizing)
+def tokenize_content(content):
+	tokenized_content = []
+	for line in content:
+		try:
+			tokenized_content.append(word_tokenize(line))
+		# if there are any problems with word tokenizing the line, mark it so that it's skipped later
+		except Exception as e:
+			# print e
+			instrumentation.increment("lines_skipped_total", stage="tokenize")
+			tokenized_content.append(None)
+	instrumentation.increment("lines_tokenized_total", len(content))
+	return tokenized_content
+
+
+# function that compiles the etymology dictionary into a table mapping each word in it to the indices (in the ordered languages) of its languages
+# the value for each word is a tuple (first_indices, all_indices, counted), where first_indices is an array with the index of the first (most recent) language,
+# all_indices is an array with the indices of all of the languages, and counted says whether the word counts towards the number of words added to a vector
+# if one of a word's languages doesn't clean to an ordered language, only the languages before it are used and the word isn't counted
+# this means each language phrase is cleaned and looked up once, rather than once per word in every sentence
+def compile_language_table(etym_dict, ordered_languages, acceptable_modifiers, list_of_languages):
+	language_indices = dict((lang, i) for i, lang in enumerate(ordered_languages))
+	# the same phrases show up in many entries, and the normalizer remembers what each one cleans to
+	normalizer = LanguageNormalizer(acceptable_modifiers, list_of_languages)
+	language_table = {}
+	for word, entry in etym_dict.items():
+		curr_indices = []
+		counted = True
+		for lang in entry:
+			try:
+				cleaned_lang = normalizer.normalize(lang)
+			except Exception as e:
+				cleaned_lang = None
+			if cleaned_lang not in language_indices:
+				counted = False
+				break
+			curr_indices.append(language_indices[cleaned_lang])
+		all_indices = np.array(curr_indices, dtype=np.intp)
+		language_table[word] = (all_indices[:1], all_indices, counted)
+	return language_table
+
+
+# function that maps every token in the tokenized data to the language table entry of its lemma
+# tokens whose lemma isn't in the language table (or that can't be lemmatized) are mapped to None
+# get_lem is only called once per distinct token, so vectorizing doesn't have to lemmatize anything
+def compile_token_table(tokenized_content, language_table):
+	token_table = {}
+	for tokens in tokenized_content:
+		if tokens is None:
+			continue
+		for word in tokens:
+			if word not in token_table:
+				try:
+					token_table[word] = language_table.get(get_lem(word)[0])
+				except Exception as e:
+					# print e
+					instrumentation.increment("lemmatize_errors_total")
+					token_table[word] = None
+	return token_table
+
+
+# function that turns a list of index arrays into a vector of length num_languages that counts how many times each index appears
+def count_indices(index_arrays, num_languages):
+	if len(index_arrays) == 0:
+		return np.zeros(num_languages)
+	return np.bincount(np.concatenate(index_arrays), minlength=num_languages).astype(np.float64)
+
+
+# function that takes in the tokens of a given example from the data, the compiled token table and an ordered list of the languages in the corpus, and finds the langauges present in that example
 # the function also takes in a boolean, include_stopwords, that determines whether words in the stopwords list (also a parameter) should be included in the vectorization
 # the function returns two vectors of length (number of languages) where an index in the vector corresponds to the index of a langauge in the ordered languages list
 # and the value at that index represents the number of times that language is in the example
 # the first vector uses only the first language in a given word's language list (so it represents the most recent language of origin)
 # the other vector uses all of the langauges
 # lastly, the function takes a variable indicating whether the vector values should be determined by the count of languages present or frequency (relative to number of words)
-def vectorize(line, etym_dict, ordered_languages, acceptable_modifiers, list_of_languages, include_stopwords, stop_words, freq_or_count):
-	# initialize the vectors
-	vector_first = np.zeros(len(ordered_languages))
-	vector_all = np.zeros(len(ordered_languages))
-	words_added = 0
-	try:
-		for word in word_tokenize(line):
-			if (include_stopwords == False) and (word in stop_words):
-				continue
-			else:
-				try:
-					lem = get_lem(word)[0]
-					curr_entry = ""
-					# the lem should be in the dictionary, but check just in case
-					if lem in etym_dict:
-						curr_entry = etym_dict[lem]
-						first = True
-						for lang in curr_entry:
-							cleaned_lang = clean_entry(lang, acceptable_modifiers, list_of_languages)
-							idx = ordered_languages.keys().index(cleaned_lang)
-							if first == True:
-								vector_first[idx] += 1
-							vector_all[idx] += 1
-							first = False
-						words_added += 1
-				# if there's a problem with getting the languages for a given word, skip it
-				except Exception as e:
-					# print e
-					pass
-	# if there are any problems with word tokenizing the line, return false
-	except Exception as e:
-		# print e
+# if the lemmas of the tokens (from lemmatize_content) are given, then the entries are looked up by lemma instead of by token, so token_table should be the language table
+def vectorize(tokens, token_table, ordered_languages, include_stopwords, stop_words, freq_or_count, lemmas=None):
+	# if the line couldn't be tokenized, return false
+	if tokens is None:
 		return False
+	if lemmas is None:
+		lemmas = tokens
+	first_indices = []
+	all_indices = []
+	words_added = 0
+	stopwords_skipped = 0
+	for word, lemma in zip(tokens, lemmas):
+		if (include_stopwords == False) and (word in stop_words):
+			stopwords_skipped += 1
+			continue
+		entry = token_table.get(lemma)
+		# words that aren't in the dictionary are skipped
+		if entry is not None:
+			first_indices.append(entry[0])
+			all_indices.append(entry[1])
+			if entry[2]:
+				words_added += 1
+	if instrumentation.enabled:
+		instrumentation.increment("tokens_processed_total", len(tokens) - stopwords_skipped)
+		instrumentation.increment("dictionary_hits_total", len(first_indices))
+		instrumentation.increment("dictionary_misses_total", len(tokens) - stopwords_skipped - len(first_indices))
+	vector_first = count_indices(first_indices, len(ordered_languages))
+	vector_all = count_indices(all_indices, len(ordered_languages))
 	if freq_or_count == "frequency":
 		if words_added != 0:
-			for i in range(len(vector_first)):
-				vector_first[i] /= float(words_added)
-				vector_all[i] /= float(words_added)
+			vector_first /= float(words_added)
+			vector_all /= float(words_added)
 	return vector_first, vector_all
 
 
-def get_vectors(content, etym_dict, ordered_languages, acceptable_modifiers, list_of_languages, include_stopwords, stop_words, freq_or_count):
+def get_vectors(tokenized_content, token_table, ordered_languages, include_stopwords, stop_words, freq_or_count, lemmatized_content=None):
 	vectors_first = []
 	vectors_all = []
-	for line in content:
-		# vectorize the line, if there's an error (because it returned False, which isn't iterable) then skip
+	for i, tokens in enumerate(tokenized_content):
+		# lines that couldn't be tokenized are skipped (they were already counted as skipped by tokenize_content)
+		if tokens is None:
+			continue
+		# vectorize the line, if there's an error then skip it and count it as skipped
 		try:
-			vector_first, vector_all = vectorize(line, etym_dict, ordered_languages, acceptable_modifiers, list_of_languages, include_stopwords, stop_words, freq_or_count)
+			lemmas = lemmatized_content[i] if lemmatized_content is not None else None
+			vector_first, vector_all = vectorize(tokens, token_table, ordered_languages, include_stopwords, stop_words, freq_or_count, lemmas)
 			vectors_first.append(vector_first)
 			vectors_all.append(vector_all)
-		except:
-			pass
+		except Exception as e:
+			instrumentation.increment("lines_skipped_total", stage="vectorize")
 	return vectors_first, vectors_all
 
-# function to generate a testing indices of a list of vectors for a given number of folds
-# this function will create an array of length (num_folds) in which each element contains the indices of (number of vectors / num_folds) vectors that
+
+# function that vectorizes all of the tokenized data in one pass and returns the vectors for every variation as scipy sparse (CSR) matrices
+# the result is a dictionary keyed by (include_stopwords, freq_or_count) whose values are (matrix_first, matrix_all), with one row per line that could be tokenized
+# (the same rows, in the same order, that get_vectors returns) and one column per ordered language
+# the languages of all the words are gathered once, the stopword variation is made by masking out the stopwords,
+# and the frequency variation is made by dividing each row by the number of words added to it
+# as with get_vectors, if lemmatized_content (from lemmatize_content) is given then the entries are looked up by lemma in token_table, which should be the language table
+def get_feature_matrices(tokenized_content, token_table, ordered_languages, stop_words, lemmatized_content=None):
+	num_languages = len(ordered_languages)
+	# give each distinct word that has an entry an id, and flatten the language indices of those words into one array
+	word_ids = {}
+	first_lengths = []
+	all_lengths = []
+	flat_first = []
+	flat_all = []
+	counted = []
+	is_stopword = []
+	# the row and word id of every occurrence of a word with an entry
+	occurrence_rows = []
+	occurrence_ids = []
+	num_rows = 0
+	for i, tokens in enumerate(tokenized_content):
+		# lines that couldn't be tokenized are skipped
+		if tokens is None:
+			continue
+		# each distinct (token, lemma) pair gets its own id when looking up by lemma, since the stopwords are still tokens
+		if lemmatized_content is None:
+			keys = tokens
+		else:
+			keys = zip(tokens, lemmatized_content[i])
+		for key in keys:
+			if key not in word_ids:
+				if lemmatized_content is None:
+					word, entry = key, token_table.get(key)
+				else:
+					word, entry = key[0], token_table.get(key[1])
+				if entry is None:
+					word_ids[key] = -1
+				else:
+					word_ids[key] = len(counted)
+					flat_first.append(entry[0])
+					flat_all.append(entry[1])
+					first_lengths.append(len(entry[0]))
+					all_lengths.append(len(entry[1]))
+					counted.append(entry[2])
+					is_stopword.append(word in stop_words)
+			word_id = word_ids[key]
+			if word_id != -1:
+				occurrence_rows.append(num_rows)
+				occurrence_ids.append(word_id)
+		num_rows += 1
+	if instrumentation.enabled:
+		num_tokens = sum(len(tokens) for tokens in tokenized_content if tokens is not None)
+		instrumentation.increment("tokens_processed_total", num_tokens)
+		instrumentation.increment("dictionary_hits_total", len(occurrence_rows))
+		instrumentation.increment("dictionary_misses_total", num_tokens - len(occurrence_rows))
+	occurrence_rows = np.array(occurrence_rows, dtype=np.intp)
+	occurrence_ids = np.array(occurrence_ids, dtype=np.intp)
+	counted = np.array(counted, dtype=bool)
+	is_stopword = np.array(is_stopword, dtype=bool)
+	# the number of words added to each row, with and without the stopwords
+	words_added = {}
+	words_added[True] = np.bincount(occurrence_rows, weights=counted[occurrence_ids], minlength=num_rows)
+	words_added[False] = np.bincount(occurrence_rows, weights=(counted & ~is_stopword)[occurrence_ids], minlength=num_rows)
+	matrices = {}
+	for first_or_all, lengths, flat in [("first", first_lengths, flat_first), ("all", all_lengths, flat_all)]:
+		rows, columns, stopword_mask = gather_language_indices(occurrence_rows, occurrence_ids, np.array(lengths, dtype=np.intp), flat, is_stopword)
+		for include_stopwords in [True, False]:
+			if include_stopwords:
+				count_matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(num_rows, num_languages))
+			else:
+				keep = ~stopword_mask
+				count_matrix = sparse.csr_matrix((np.ones(keep.sum()), (rows[keep], columns[keep])), shape=(num_rows, num_languages))
+			count_matrix.sum_duplicates()
+			# rows where no words were added are left as counts (the same as vectorize)
+			denominators = words_added[include_stopwords].copy()
+			denominators[denominators == 0] = 1
+			frequency_matrix = count_matrix.copy()
+			frequency_matrix.data /= np.repeat(denominators, np.diff(frequency_matrix.indptr))
+			matrices.setdefault((include_stopwords, "count"), {})[first_or_all] = count_matrix
+			matrices.setdefault((include_stopwords, "frequency"), {})[first_or_all] = frequency_matrix
+	return dict((key, (value["first"], value["all"])) for key, value in matrices.items())
+
+
+# function that expands the occurrences of words into one (row, column) pair per language of each occurrence
+# lengths and flat hold the number of language indices and the array of language indices of each word id
+# it also returns whether the word each pair came from is a stopword
+def gather_language_indices(occurrence_rows, occurrence_ids, lengths, flat, is_stopword):
+	if len(flat) == 0:
+		return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=bool)
+	starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+	flat = np.concatenate(flat)
+	occurrence_lengths = lengths[occurrence_ids]
+	# position of each pair within its occurrence, offset by where that word's indices start in flat
+	offsets = np.arange(occurrence_lengths.sum()) - np.repeat(np.cumsum(occurrence_lengths) - occurrence_lengths, occurrence_lengths)
+	positions = np.repeat(starts[occurrence_ids], occurrence_lengths) + offsets
+	rows = np.repeat(occurrence_rows, occurrence_lengths)
+	return rows, flat[positions].astype(np.intp), np.repeat(is_stopword[occurrence_ids], occurrence_lengths)
+
+
+# function to generate the testing indices of a given number of examples for a given number of folds
+# this function will create a list of length (num_folds) in which each element is a numpy array containing the indices of (number of examples / num_folds) examples that
 # represent the testing data for a given fold
-def generate_folds(vectors, num_folds):
-	testing_data_indices = []
-	num_vectors = len(vectors)
-	# figure out how many examples are in each fold given the desired number of folds and the total number of examples
-	fold_size = num_vectors / num_folds
-	# Randomly generate a list of the indices between 0 and the number of vectors (sample without replacement so each index is in there only once)
-	rand_indices = random.sample(xrange(num_vectors), num_vectors)
-	# for each fold, take the next fold_size number of indices and put them in testing_data_indices
-	for fold_count in range(num_folds):
+# the examples are shuffled with a random generator seeded with seed (so the same seed always gives the same folds)
+# if labels (an array with the label of each example) are given, the folds are stratified: the examples of each label are split into the folds separately,
+# so every fold has the same proportion of each label
+def generate_folds(num_examples, num_folds, seed=None, labels=None):
+	random_state = np.random.RandomState(seed)
+	if labels is None:
+		groups = [np.arange(num_examples)]
+	else:
+		labels = np.asarray(labels)
+		groups = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+	testing_data_indices = [[] for fold_count in range(num_folds)]
+	for group in groups:
+		# Randomly order the indices of the group
+		rand_indices = group[random_state.permutation(len(group))]
+		# figure out how many examples are in each fold given the desired number of folds and the number of examples in the group
+		fold_size = len(group) // num_folds
 		# the testing indices of the first fold are 0:fold_size-1, the second are fold_size:2*fold_size-1, and so on
-		start = fold_size * fold_count
-		end = fold_size * (fold_count + 1)
-		if fold_count != num_folds - 1:
-			curr_indices = rand_indices[start:end]
-		else:
-			# if we're at the end, just take all of the remaining vectors
-			curr_indices = rand_indices[start:(len(rand_indices))]
-		testing_data_indices.append(curr_indices)
-	return testing_data_indices
-
-
-# function to get the testing and training vectors for a the testing/training indices in a given fold
-# it is passed the testing indices for the fold and vectors, and the label
-# it separates the vectors into testing/training data depending on whether a given vector's index is in the testing indices or not
-# the function returns arrays of the testing and training data and labels for the fold
-def get_data_for_fold(testing_data_indices, vectors, label):
-	training_data = []
-	training_labels = []
-	testing_data = []
-	testing_labels = []
-	# go through the indices in range of the number of vectors and put the data into testing/training depending on if the the index is in testing indices
-	for i in range(len(vectors)):
-		if i in testing_data_indices:
-			testing_data.append(vectors[i])
-			testing_labels.append(label)
-		else:
-			training_data.append(vectors[i])
-			training_labels.append(label)
-	return training_data, training_labels, testing_data, testing_labels 
+		# if we're at the end, just take all of the remaining examples
+		bounds = [fold_size * fold_count for fold_count in range(num_folds)] + [len(group)]
+		for fold_count in range(num_folds):
+			testing_data_indices[fold_count].append(rand_indices[bounds[fold_count]:bounds[fold_count + 1]])
+	return [np.sort(np.concatenate(fold)) for fold in testing_data_indices]
 
 
+# function that returns a boolean mask over num_examples examples that is True for the testing indices of a fold
+def get_fold_mask(testing_data_indices, num_examples):
+	mask = np.zeros(num_examples, dtype=bool)
+	mask[testing_data_indices] = True
+	return mask
+
+
+# function to get the testing and training data for the testing/training indices in a given fold
+# it is passed the testing indices for the fold, a matrix (numpy array or scipy sparse matrix) with one row per example, and the array of labels
+# the rows are split into testing/training data with one pass over a boolean mask instead of checking every index against the list of testing indices
+# the function returns the training and testing data and labels for the fold
+# when the testing indices are one contiguous run (e.g. from folds over data that was shuffled once up front) the testing data is a slice, which is a view
+# of a numpy array rather than a copy
+def get_data_for_fold(testing_data_indices, data, labels):
+	labels = np.asarray(labels)
+	num_examples = data.shape[0]
+	testing_data_indices = np.asarray(testing_data_indices)
+	training_indices = np.flatnonzero(~get_fold_mask(testing_data_indices, num_examples))
+	if len(testing_data_indices) > 0 and testing_data_indices[-1] - testing_data_indices[0] == len(testing_data_indices) - 1 and (np.diff(testing_data_indices) == 1).all():
+		start, end = testing_data_indices[0], testing_data_indices[-1] + 1
+		testing_data = data[start:end]
+		testing_labels = labels[start:end]
+	else:
+		testing_data = data[testing_data_indices]
+		testing_labels = labels[testing_data_indices]
+	return data[training_indices], labels[training_indices], testing_data, testing_labels
+
 
 # function that builds an svm classifier, fits training data using training labels, and makes predictions on testing data
 # the function returns the predictions array
@@ -205,6 +482,157 @@ def classify_svm(training_data, training_labels, testing_data):
 	return predictions
 
 
+# the classifier backends that classify can use
+# "svm" is the kernel (RBF) svm from classify_svm, whose training time grows faster than linearly with the number of examples
+# the others are linear models whose training time grows linearly, for much larger corpora:
+# "linear_svm" is a linear svm, "sgd" is a linear svm trained with stochastic gradient descent over mini-batches (see IncrementalClassifier),
+# and "sgd_rbf" and "sgd_nystroem" are the same but first map the vectors to an approximation of the RBF kernel's feature space
+# (with random Fourier features or the Nystroem method), to keep most of what the RBF kernel adds over a linear model
+CLASSIFIER_BACKENDS = ["svm", "linear_svm", "sgd", "sgd_rbf", "sgd_nystroem"]
+
+
+# a linear svm trained with stochastic gradient descent, one mini-batch at a time with partial_fit, so the training data never has to be in memory at once
+# kernel_approximation is an optional (unfitted) transformer such as kernel_approximation.RBFSampler or kernel_approximation.Nystroem; it's fitted on the
+# first mini-batch it sees and then maps every mini-batch before it reaches the linear model
+class IncrementalClassifier(object):
+	def __init__(self, kernel_approximation=None, batch_size=1000, num_epochs=5, alpha=0.0001, seed=0):
+		self.kernel_approximation = kernel_approximation
+		self.kernel_approximation_fitted = False
+		self.batch_size = batch_size
+		self.num_epochs = num_epochs
+		self.seed = seed
+		self.classifier = linear_model.SGDClassifier(loss="hinge", alpha=alpha, random_state=seed)
+
+	def transform(self, data):
+		if self.kernel_approximation is None:
+			return data
+		if not self.kernel_approximation_fitted:
+			self.kernel_approximation.fit(data)
+			self.kernel_approximation_fitted = True
+		return self.kernel_approximation.transform(data)
+
+	# function that trains the classifier on one mini-batch, where classes is every label that can appear in any of the mini-batches
+	def partial_fit(self, data, labels, classes):
+		self.classifier.partial_fit(self.transform(data), labels, classes=classes)
+		return self
+
+	# function that streams an iterable of (data, labels) mini-batches into the classifier
+	def fit_batches(self, batches, classes):
+		for data, labels in batches:
+			self.partial_fit(data, labels, classes)
+		return self
+
+	# function that trains the classifier on all of the training data, going through it num_epochs times in shuffled mini-batches
+	def fit(self, data, labels):
+		labels = np.asarray(labels)
+		classes = np.unique(labels)
+		random_state = np.random.RandomState(self.seed)
+		for epoch in range(self.num_epochs):
+			order = random_state.permutation(data.shape[0])
+			self.fit_batches(((data[order[start:start + self.batch_size]], labels[order[start:start + self.batch_size]]) for start in range(0, len(order), self.batch_size)), classes)
+		return self
+
+	def predict(self, data):
+		return self.classifier.predict(self.transform(data))
+
+
+# function that builds an unfitted classifier for one of the CLASSIFIER_BACKENDS
+# num_features is the number of columns of the vectors, which sets gamma for the RBF kernel approximations the same way the default svm does (1 / num_features)
+def build_classifier(backend, num_features, num_components=500, seed=0):
+	if backend == "svm":
+		return svm.SVC()
+	if backend == "linear_svm":
+		return svm.LinearSVC(random_state=seed)
+	if backend == "sgd":
+		return IncrementalClassifier(seed=seed)
+	if backend == "sgd_rbf":
+		return IncrementalClassifier(kernel_approximation.RBFSampler(gamma=1.0 / num_features, n_components=num_components, random_state=seed), seed=seed)
+	if backend == "sgd_nystroem":
+		return IncrementalClassifier(kernel_approximation.Nystroem(gamma=1.0 / num_features, n_components=num_components, random_state=seed), seed=seed)
+	raise ValueError("unknown classifier backend %r (expected one of %s)" % (backend, ", ".join(CLASSIFIER_BACKENDS)))
+
+
+# function that builds a classifier with the given backend, fits training data using training labels, and makes predictions on testing data
+# the function returns the predictions array
+def classify(training_data, training_labels, testing_data, backend="svm"):
+	if backend == "svm":
+		return classify_svm(training_data, training_labels, testing_data)
+	classifier = build_classifier(backend, training_data.shape[1])
+	classifier.fit(training_data, training_labels)
+	return classifier.predict(testing_data)
+
+
+# the data for the cross validation tasks, set by run_cross_validation right before the worker processes are started
+# the workers are forked from this process and inherit it, so the feature matrices are shared with them instead of being pickled and sent with every task
+cross_validation_data = []
+cross_validation_labels = None
+cross_validation_folds = []
+
+
+# function that runs one cross validation task, given as (variant, fold, backend), and returns its f1 score and how many seconds training and predicting took
+# the variant is an index into cross_validation_data, the feature matrices of the variations of the experiment, which all share
+# the same labels and folds
+def evaluate_fold(task):
+	variant, fold, backend = task
+	# split the data into testing and training given the indices for the current fold
+	training_data, training_labels, testing_data, testing_labels = get_data_for_fold(cross_validation_folds[fold], cross_validation_data[variant], cross_validation_labels)
+	start_time = time.time()
+	f1_pred = classify(training_data, training_labels, testing_data, backend)
+	seconds = time.time() - start_time
+	return metrics.f1_score(testing_labels, f1_pred), seconds
+
+
+# function that records the time and score of a finished fold in the metrics
+# it's called in the parent process, since metrics counted in the pool's worker processes would be lost
+def record_fold(task, score):
+	variant, fold, backend = task
+	f1, seconds = score
+	instrumentation.observe("fold_seconds", seconds, backend=backend)
+	instrumentation.observe("fold_f1_score", f1, backend=backend)
+	instrumentation.increment("folds_done_total", backend=backend)
+
+
+# function that runs every fold of every variant of the experiment with every classifier backend
+# variants is a list of feature matrices with one row per example, labels is the array of (binary) labels of the examples, and folds comes from generate_folds
+# it returns a list (in the order of variants) of lists (in the order of backends) of lists (in the order of folds) of (f1 score, seconds) tuples
+# the tasks are spread across a pool of num_processes worker processes (or just run in this process if num_processes is 1),
+# and since every task is deterministic given its folds, the scores are the same however many processes are used
+def run_cross_validation(variants, labels, folds, num_processes, backends=None):
+	global cross_validation_data, cross_validation_labels, cross_validation_folds
+	# the kernel svm is the only backend unless others are given
+	if backends is None:
+		backends = ["svm"]
+	cross_validation_data = variants
+	cross_validation_labels = labels
+	cross_validation_folds = folds
+	num_folds = len(folds)
+	tasks = [(variant, fold, backend) for variant in range(len(variants)) for backend in backends for fold in range(num_folds)]
+	if num_processes == 1:
+		scores = []
+		for task in tasks:
+			scores.append(evaluate_fold(task))
+			record_fold(task, scores[-1])
+	else:
+		pool = multiprocessing.Pool(num_processes)
+		try:
+			# pool.imap returns the scores in the order of the tasks, whichever order they finish in
+			# (they're collected one by one rather than all at the end, so the fold metrics update while the run goes on)
+			scores = []
+			for task, score in zip(tasks, pool.imap(evaluate_fold, tasks, chunksize=1)):
+				record_fold(task, score)
+				scores.append(score)
+		finally:
+			pool.close()
+			pool.join()
+	results = []
+	for variant in range(len(variants)):
+		results.append([])
+		for i in range(len(backends)):
+			start = (variant * len(backends) + i) * num_folds
+			results[-1].append(scores[start:start + num_folds])
+	return results
+
+
 # function that finds predictions that were misclassified
 # the function keeps track of the indices in the testing/prediction data where the misclassifications were made 
 # and returns that array so that the misclassified examples can be accessed later (the total number of miclassifications can be found by determining the length of the array)
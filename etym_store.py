@@ -0,0 +1,296 @@
+# coding=utf-8
+import sys
+import os
+import mmap
+import struct
+import zlib
+import numpy as np
+import etym_classifier_utils as utils
+
+
+# the binary etymology store is laid out as follows (all integers are little endian):
+#   header: magic, format version, number of languages, number of words, number of language entries, number of hash index slots
+#   language offsets (uint32, number of languages + 1) followed by the language names
+#   word offsets (uint32, number of words + 1) followed by the words, in sorted order
+#   entry offsets (uint32, number of words + 1) followed by the language indices of every entry (int16, flattened)
+#   a hash index (uint32, a power of two in size) of open addressing slots holding (position of a word in the sorted words + 1), or 0 for an empty slot
+# each section starts on an 8 byte boundary so the arrays can be read straight out of the mapped file
+STORE_MAGIC = "ETYMSTOR"
+STORE_VERSION = 1
+HEADER_FORMAT = "<8sIIIII"
+# the entries appended to an etymology file after its store was compiled (by language_registry.py ingest) go into a small second store,
+# the delta store, which is looked up before the main one; once it holds more words than this fraction of the main store's,
+# the two are compacted into a new main store
+MAX_DELTA_FRACTION = 0.05
+
+
+# function that hashes a word for the store's hash index
+def word_hash(word):
+	return zlib.crc32(word) & 0xffffffff
+
+
+# function that pads a section of the store so that the next one starts on an 8 byte boundary
+def pad_to_alignment(output, position):
+	padding = (-position) % 8
+	output.write("\0" * padding)
+	return position + padding
+
+
+# function that writes an array of offsets followed by the concatenated strings they point into
+def write_string_table(output, position, strings):
+	offsets = np.zeros(len(strings) + 1, dtype="<u4")
+	offsets[1:] = np.cumsum([len(string) for string in strings])
+	output.write(offsets.tostring())
+	output.write("".join(strings))
+	return pad_to_alignment(output, position + offsets.nbytes + int(offsets[-1]))
+
+
+# function that compiles an etymology dictionary (as returned by build_etym_dict) into a binary store at store_file
+# every language is interned into a single table, and each word's entry becomes a run of int16 indices into that table
+def compile_etym_store(etym_dict, store_file):
+	words = sorted(etym_dict.keys())
+	language_ids = {}
+	languages = []
+	entry_offsets = np.zeros(len(words) + 1, dtype="<u4")
+	entries = []
+	for i, word in enumerate(words):
+		for lang in etym_dict[word]:
+			if lang not in language_ids:
+				language_ids[lang] = len(languages)
+				languages.append(lang)
+			entries.append(language_ids[lang])
+		entry_offsets[i + 1] = len(entries)
+	if len(languages) > np.iinfo(np.int16).max:
+		raise ValueError("too many distinct languages (%d) for an etymology store" % len(languages))
+	# the hash index is kept at most half full so that probe sequences stay short
+	num_slots = 1
+	while num_slots < 2 * len(words):
+		num_slots *= 2
+	hash_index = np.zeros(num_slots, dtype="<u4")
+	for i, word in enumerate(words):
+		slot = word_hash(word) & (num_slots - 1)
+		while hash_index[slot] != 0:
+			slot = (slot + 1) & (num_slots - 1)
+		hash_index[slot] = i + 1
+	# written to a temporary file and renamed into place, so a store that's memory mapped (or being loaded) is never overwritten while it's read
+	temp_file = store_file + ".tmp"
+	with open(temp_file, "wb") as output:
+		header = struct.pack(HEADER_FORMAT, STORE_MAGIC, STORE_VERSION, len(languages), len(words), len(entries), num_slots)
+		output.write(header)
+		position = pad_to_alignment(output, len(header))
+		position = write_string_table(output, position, languages)
+		position = write_string_table(output, position, words)
+		output.write(entry_offsets.tostring())
+		entries = np.array(entries, dtype="<i2")
+		output.write(entries.tostring())
+		pad_to_alignment(output, position + entry_offsets.nbytes + entries.nbytes)
+		output.write(hash_index.tostring())
+	os.rename(temp_file, store_file)
+
+
+# a read-only, dictionary-like view of a compiled etymology store
+# the file is memory mapped, so opening it is nearly free and processes that open the same store share its pages
+# looking up a word returns its list of languages, just like the dictionary from build_etym_dict
+class EtymStore(object):
+	def __init__(self, store_file):
+		self.store_file = store_file
+		with open(store_file, "rb") as store:
+			self.buffer = mmap.mmap(store.fileno(), 0, access=mmap.ACCESS_READ)
+		header_size = struct.calcsize(HEADER_FORMAT)
+		magic, version, num_languages, num_words, num_entries, num_slots = struct.unpack(HEADER_FORMAT, self.buffer[:header_size])
+		if magic != STORE_MAGIC:
+			raise ValueError("%s is not an etymology store" % store_file)
+		if version != STORE_VERSION:
+			raise ValueError("%s has store version %d, expected %d" % (store_file, version, STORE_VERSION))
+		self.version = version
+		position = header_size + (-header_size) % 8
+		language_offsets, language_start, position = self.read_string_table(position, num_languages)
+		# the language table is small, so it's decoded once and each language is shared by all of the entries
+		self.languages = [self.buffer[language_start + language_offsets[i]:language_start + language_offsets[i + 1]] for i in range(num_languages)]
+		self.word_offsets_position = position
+		self.word_offsets, self.word_start, position = self.read_string_table(position, num_words)
+		self.entry_offsets_position = position
+		self.entry_offsets = np.frombuffer(self.buffer, dtype="<u4", count=num_words + 1, offset=position)
+		self.entries = np.frombuffer(self.buffer, dtype="<i2", count=num_entries, offset=position + self.entry_offsets.nbytes)
+		position += self.entry_offsets.nbytes + self.entries.nbytes
+		self.hash_index_position = position + (-position) % 8
+		self.num_words = num_words
+		self.num_slots = num_slots
+
+	# function that maps the offsets of a string table starting at position and returns them, where the strings start, and where the next section starts
+	def read_string_table(self, position, count):
+		offsets = np.frombuffer(self.buffer, dtype="<u4", count=count + 1, offset=position)
+		start = position + offsets.nbytes
+		end = start + int(offsets[-1])
+		return offsets, start, end + (-end) % 8
+
+	# function that returns the word at a given position in the sorted words
+	# single values are read with struct rather than by indexing the numpy arrays, which is much faster for one value at a time
+	def word_at(self, i):
+		start, end = struct.unpack_from("<II", self.buffer, self.word_offsets_position + 4 * i)
+		return self.buffer[self.word_start + start:self.word_start + end]
+
+	# function that looks a word up in the hash index, and returns its position in the sorted words (or -1 if it isn't in the store)
+	def find(self, word):
+		slot = word_hash(word) & (self.num_slots - 1)
+		while True:
+			i = struct.unpack_from("<I", self.buffer, self.hash_index_position + 4 * slot)[0]
+			if i == 0:
+				return -1
+			if self.word_at(i - 1) == word:
+				return i - 1
+			slot = (slot + 1) & (self.num_slots - 1)
+
+	# function that returns the array of language indices (into self.languages) of the entry at a given position
+	# this is a view into the mapped file, so no copy is made
+	def language_indices_at(self, i):
+		start, end = struct.unpack_from("<II", self.buffer, self.entry_offsets_position + 4 * i)
+		return self.entries[start:end]
+
+	def __getitem__(self, word):
+		i = self.find(word)
+		if i == -1:
+			raise KeyError(word)
+		return [self.languages[lang] for lang in self.language_indices_at(i)]
+
+	def __contains__(self, word):
+		return self.find(word) != -1
+
+	def __len__(self):
+		return self.num_words
+
+	def __iter__(self):
+		for i in xrange(self.num_words):
+			yield self.word_at(i)
+
+	def get(self, word, default=None):
+		i = self.find(word)
+		if i == -1:
+			return default
+		return [self.languages[lang] for lang in self.language_indices_at(i)]
+
+	def keys(self):
+		return list(self)
+
+	def iteritems(self):
+		for i in xrange(self.num_words):
+			yield self.word_at(i), [self.languages[lang] for lang in self.language_indices_at(i)]
+
+	def items(self):
+		return list(self.iteritems())
+
+	def close(self):
+		self.buffer.close()
+
+
+# a read-only, dictionary-like view of a main store with a delta store over it: the words in the delta store are looked up there,
+# and every other word in the main store
+class EtymStoreOverlay(object):
+	def __init__(self, main, delta):
+		self.main = main
+		self.delta = delta
+		# the delta store is small, so its words that aren't in the main store are counted up front
+		self.num_words = len(main) + sum(1 for word in delta if word not in main)
+
+	def __getitem__(self, word):
+		entry = self.get(word)
+		if entry is None:
+			raise KeyError(word)
+		return entry
+
+	def __contains__(self, word):
+		return word in self.delta or word in self.main
+
+	def __len__(self):
+		return self.num_words
+
+	def __iter__(self):
+		for word, entry in self.iteritems():
+			yield word
+
+	def get(self, word, default=None):
+		entry = self.delta.get(word)
+		if entry is None:
+			entry = self.main.get(word, default)
+		return entry
+
+	def keys(self):
+		return list(self)
+
+	def iteritems(self):
+		for word, entry in self.main.iteritems():
+			if word in self.delta:
+				entry = self.delta[word]
+			yield word, entry
+		for word, entry in self.delta.iteritems():
+			if word not in self.main:
+				yield word, entry
+
+	def items(self):
+		return list(self.iteritems())
+
+	def close(self):
+		self.main.close()
+		self.delta.close()
+
+
+# function that returns the file names of the main and delta stores of an etymology file (or of a given main store)
+def store_files(etym_file, store_file=None):
+	if store_file is None:
+		store_file = os.path.splitext(etym_file)[0] + ".store"
+	return store_file, os.path.splitext(store_file)[0] + ".delta.store"
+
+
+# function that opens the compiled store for an etymology file if there is one that's at least as new as the file
+# (or one with a delta store that's at least as new as the file), and otherwise falls back to parsing the file with build_etym_dict
+def load_etym_dict(etym_file, store_file=None):
+	store_file, delta_file = store_files(etym_file, store_file)
+	if os.path.exists(store_file):
+		if os.path.getmtime(store_file) >= os.path.getmtime(etym_file):
+			return EtymStore(store_file)
+		if os.path.exists(delta_file) and os.path.getmtime(delta_file) >= os.path.getmtime(etym_file):
+			return EtymStoreOverlay(EtymStore(store_file), EtymStore(delta_file))
+	return utils.build_etym_dict(etym_file)
+
+
+# function that brings the store of an etymology file up to date after new entries were appended to the file
+# old_entries is what load_etym_dict returned before the append: if it was the store (with or without a delta store), the new entries are added to
+# the delta store, which only costs as much as the delta store, until it's big enough to be compacted into the main store; if the store was
+# out of date (so the file was parsed anyway), the store is compiled again
+# nothing is done if the file has no store; returns "delta", "compacted" or "compiled", or None
+def update_store(etym_file, old_entries, new_entries, max_delta_fraction=MAX_DELTA_FRACTION):
+	store_file, delta_file = store_files(etym_file)
+	if not os.path.exists(store_file):
+		return None
+	if isinstance(old_entries, (EtymStore, EtymStoreOverlay)):
+		main = old_entries.main if isinstance(old_entries, EtymStoreOverlay) else old_entries
+		delta_entries = dict(old_entries.delta.iteritems()) if isinstance(old_entries, EtymStoreOverlay) else {}
+		delta_entries.update(new_entries)
+		if len(delta_entries) <= max_delta_fraction * len(main):
+			compile_etym_store(delta_entries, delta_file)
+			return "delta"
+		etym_dict = dict(main.iteritems())
+		etym_dict.update(delta_entries)
+		result = "compacted"
+	else:
+		etym_dict = dict(old_entries)
+		etym_dict.update(new_entries)
+		result = "compiled"
+	compile_etym_store(etym_dict, store_file)
+	if os.path.exists(delta_file):
+		os.remove(delta_file)
+	return result
+
+
+# this file should be called from the command line as follows:
+# python etym_store.py <etymology_file> [<store_file>]
+# it compiles the etymology file (e.g. scraped_etymologies.txt) into a binary store, which defaults to the same name with a .store extension
+if __name__ == "__main__":
+	etym_file = sys.argv[1]
+	store_file, delta_file = store_files(etym_file, sys.argv[2] if len(sys.argv) > 2 else None)
+	etym_dict = utils.build_etym_dict(etym_file)
+	compile_etym_store(etym_dict, store_file)
+	# the new store has every entry, so a delta store left from ingesting entries into the old one isn't needed anymore
+	if os.path.exists(delta_file):
+		os.remove(delta_file)
+	print "Compiled %d words into %s" % (len(etym_dict), store_file)
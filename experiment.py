@@ -1,106 +1,205 @@
 # coding=utf-8
 import sys
 import os
+import argparse
+import multiprocessing
 import numpy as np
+from scipy import sparse
 import sklearn
 from sklearn import svm
 from nltk import word_tokenize
-import collections
 from nltk.corpus import stopwords
 from nltk.stem.wordnet import WordNetLemmatizer
-from get_etym import get_lem
-import random
 import etym_classifier_utils as utils
+import etym_store
+import language_registry
+import feature_cache
+import hyperparameter_search
+import instrumentation
 import time
 
 
+# function that parses a comma separated list of numbers
+def parse_values(values):
+	return [float(value) for value in values.split(",")]
+
+
 # this script should be called from the command line as follows:
-# python experiment.py <results_output_file>
+# python experiment.py <results_output_file> [--processes N] [--seed S] [--backends svm,sgd,...] [--lemmatize word|sentence] [--search] [--feature-cache DIR] [--feature-cache-size MB] [--metrics-file F] [--metrics-port P]
 if __name__ == "__main__":
 	start_time = time.time()
-	outfile = sys.argv[1]
+	parser = argparse.ArgumentParser()
+	parser.add_argument("results_output_file")
+	parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="number of processes to run the folds on (1 runs them in this process)")
+	parser.add_argument("--seed", type=int, default=None, help="seed for splitting the data into folds")
+	parser.add_argument("--backends", default="svm", help="comma separated classifier backends to compare (from %s)" % ", ".join(utils.CLASSIFIER_BACKENDS))
+	parser.add_argument("--lemmatize", default="word", choices=["word", "sentence"], help="tag each word on its own, or words in the context of their sentence (in bulk)")
+	parser.add_argument("--search", action="store_true", help="search the hyperparameters of each backend (with nested cross validation and successive halving over the folds) and report the configurations picked for each variation")
+	parser.add_argument("--search-c", default=",".join("%g" % value for value in hyperparameter_search.DEFAULT_C_VALUES), help="comma separated values of C to search for svm and linear_svm")
+	parser.add_argument("--search-alpha", default=",".join("%g" % value for value in hyperparameter_search.DEFAULT_ALPHA_VALUES), help="comma separated values of alpha to search for the sgd backends")
+	parser.add_argument("--search-gamma-scales", default=",".join("%g" % value for value in hyperparameter_search.DEFAULT_GAMMA_SCALES), help="comma separated values of gamma to search, as multiples of 1 / the number of features")
+	parser.add_argument("--search-eta", type=int, default=3, help="keep the best 1/eta of the configurations at each rung of the search")
+	parser.add_argument("--search-min-folds", type=int, default=2, help="number of inner folds every configuration is scored on in the first rung of the search")
+	parser.add_argument("--max-gram-mb", type=int, default=hyperparameter_search.MAX_GRAM_MB, help="largest Gram matrix (in MB) of every example of a variation that the svm search precomputes, once for each gamma, and shares between the processes")
+	parser.add_argument("--feature-cache", default=feature_cache.FEATURE_CACHE_DIR, help="directory the feature matrices are cached in")
+	parser.add_argument("--feature-cache-size", type=int, default=feature_cache.DEFAULT_MAX_BYTES / (1024 * 1024), help="size of the feature cache in MB (0 turns it off)")
+	parser.add_argument("--metrics-file", default=None, help="keep the run's metrics (in the Prometheus text format) up to date in this file")
+	parser.add_argument("--metrics-port", type=int, default=None, help="serve the run's metrics on http://127.0.0.1:<port>/metrics")
+	args = parser.parse_args()
+	instrumentation.start(args.metrics_file, args.metrics_port)
+	instrumentation.describe("stage_seconds", "Time taken by each stage of the experiment")
+	stage_start = time.time()
+	outfile = args.results_output_file
 	output = open(outfile, 'w')
 	output.write("-------Experiment Results-------\n")
-	permutation_counter = 0
 
 	lemmatizer = WordNetLemmatizer()
 	stop_words = set(stopwords.words('english'))
 
 	subjective_file = os.getcwd() + "/rotten_imdb/quote.tok.gt9.5000"
-	subjective_content = open(subjective_file).readlines()
 	objective_file = os.getcwd() + "/rotten_imdb/plot.tok.gt9.5000"
-	objective_content = open(objective_file).readlines()
-
-	etym_dict = utils.build_etym_dict("scraped_etymologies.txt")
-
-	all_languages = utils.get_list_of_languages(etym_dict)
-	# define the list of language modifiers that are acceptable
-	acceptable_modifiers = ["Proto", "Old", "Middle", "High", "Low", "Late", "Medieval", "Modern", "Anglo-French", "American", "Canadian"]
-	list_of_languages = []
+	etym_file = "scraped_etymologies.txt"
+	acceptable_modifiers = utils.ACCEPTABLE_MODIFIERS
 	# read in a list of possible languages (from wiktionary)
-	with open(os.getcwd() + "/list_of_languages.txt") as list_of_languages_file:
-		content = list_of_languages_file.readlines()
-		for line in content:
-			list_of_languages.append(line.rstrip())
-	other_languages = ["PIE", "Germanic", "Norse", "Etruscan", "Gaelic", "Italic", "Gaulish"]
-	list_of_languages += other_languages
-	cleaned_languages = utils.get_cleaned_languages(all_languages, acceptable_modifiers, list_of_languages)
-	ordered_languages = collections.OrderedDict(sorted(cleaned_languages.items(), key=lambda t: t[0]))
-	print "Languages cleaned"
+	list_of_languages = utils.read_list_of_languages(os.getcwd() + "/list_of_languages.txt")
 
+	# each variation of the experiment, with the headers that go before its results: (headers, (include_stopwords, freq_or_count, first_or_all))
+	variant_settings = []
 	include_stopwords_options = [True, False]
 	# outer loop of experiment: vary whether we include stopwords or not
 	for include_stopwords in include_stopwords_options:
-		print "-------Experiment variation: include_stopwords set to %s-------" % include_stopwords
-		output.write("-------Experiment variation: include_stopwords set to %s-------\n" % include_stopwords)
+		headers = ["-------Experiment variation: include_stopwords set to %s-------" % include_stopwords]
 		freq_or_count_options = ["count", "frequency"]
 		# second loop: vary whether we generate vectors using language frequency or count
 		for freq_or_count in freq_or_count_options:
-			print "-------Experiment variation: vectors created using language %s-------" % freq_or_count
-			output.write("-------Experiment variation: vectors created using language %s-------\n" % freq_or_count)
-			subjective_vectors_first, subjective_vectors_all = utils.get_vectors(subjective_content, etym_dict, ordered_languages, acceptable_modifiers, list_of_languages, include_stopwords, stop_words, freq_or_count)
-			objective_vectors_first, objective_vectors_all = utils.get_vectors(objective_content, etym_dict, ordered_languages, acceptable_modifiers, list_of_languages, include_stopwords, stop_words, freq_or_count)
-			print "Vectors created"
-
-			num_folds = 10
-			subjective_testing_indices = utils.generate_folds(subjective_vectors_first, num_folds)
-			objective_testing_indices = utils.generate_folds(objective_vectors_first, num_folds)
+			headers.append("-------Experiment variation: vectors created using language %s-------" % freq_or_count)
 			first_or_all_languages_options = ["first language", "all languages"]
 			# third loop: vary whether we use all the etymology information or just the most recent language
-			# this is the third loop because it doesn't require that the vectors are remade, so for efficiency it should be within the other two loops
 			for parameter in first_or_all_languages_options:
-				print "-------Experiment variation: using %s-------" % parameter
-				output.write("-------Experiment variation: using %s-------\n" % parameter)
-				print "--Perumutation %d--" % permutation_counter
-				permutation_counter += 1
-				misclassified_indices_for_exp = []
-				for i in range(num_folds):
-					# split the data into testing and training given the indices for the current fold
-					if parameter == "first language":
-						sub_training_data, sub_training_labels, sub_testing_data, sub_testing_labels = utils.get_data_for_fold(subjective_testing_indices[i], subjective_vectors_first, "subjective")
-						ob_training_data, ob_training_labels, ob_testing_data, ob_testing_labels = utils.get_data_for_fold(objective_testing_indices[i], objective_vectors_first, "objective")
-					else:
-						sub_training_data, sub_training_labels, sub_testing_data, sub_testing_labels = utils.get_data_for_fold(subjective_testing_indices[i], subjective_vectors_all, "subjective")
-						ob_training_data, ob_training_labels, ob_testing_data, ob_testing_labels = utils.get_data_for_fold(objective_testing_indices[i], objective_vectors_all, "objective")
-					training_data = sub_training_data + ob_training_data
-					training_labels = sub_training_labels + ob_training_labels
-					testing_data = sub_testing_data + ob_testing_data
-					testing_labels  = sub_testing_labels + ob_testing_labels
-
-					lb = sklearn.preprocessing.LabelBinarizer()
-					y_train = np.array([number[0] for number in lb.fit_transform(training_labels)])
-					y_test = np.array([number[0] for number in lb.fit_transform(testing_labels)])
-					f1_pred = utils.classify_svm(training_data, y_train, testing_data)
-					result = "f1_score: %.3f\n" % sklearn.metrics.f1_score(y_test, f1_pred)
-					# predictions = utils.classify_svm(training_data, training_labels, testing_data)
-					# misclassified_indices = utils.find_errors(predictions, testing_labels)
-					# misclassified_indices_for_exp.append(misclassified_indices)
-					# misclassified_pct = 100*(float(len(misclassified_indices)) / len(predictions))
-					# result = "%.1f%% misclassified \n" % (misclassified_pct)
-					print result
-					output.write(result)
+				headers.append("-------Experiment variation: using %s-------" % parameter)
+				variant_settings.append((headers, (include_stopwords, freq_or_count, parameter)))
+				headers = []
 
-	total_time = time.time() - start_time
-	print "time elapsed: %d minutes" % (total_time / 60)
+	# the feature matrix of each variation: (include_stopwords, freq_or_count, first_or_all) -> matrix
+	variant_matrices = {}
+	if args.feature_cache_size > 0:
+		# the matrices are cached under a fingerprint of everything they're made from, so if none of it changed they're loaded instead of being made again
+		cache = feature_cache.FeatureCache(args.feature_cache, args.feature_cache_size * 1024 * 1024)
+		inputs = feature_cache.experiment_inputs([subjective_file, objective_file], etym_file, language_registry.REGISTRY_FILE,
+			acceptable_modifiers, list_of_languages, stop_words, args.lemmatize)
+		cache_keys = dict((setting, feature_cache.fingerprint(dict(inputs, variant=setting))) for headers, setting in variant_settings)
+		for headers, setting in variant_settings:
+			entry = cache.get(cache_keys[setting])
+			if entry is not None:
+				variant_matrices[setting], labels = entry
+	else:
+		cache = None
+
+	if len(variant_matrices) == len(variant_settings):
+		print "Vectors loaded from the feature cache"
+		instrumentation.set_gauge("stage_seconds", time.time() - stage_start, stage="load")
+	else:
+		subjective_content = open(subjective_file).readlines()
+		objective_content = open(objective_file).readlines()
 
+		# use the compiled etymology store if there is one (see etym_store.py), otherwise parse the scraped etymologies
+		etym_dict = etym_store.load_etym_dict(etym_file)
 
+		# use the registry's stable columns if there is one (see language_registry.py), otherwise the languages sorted by name
+		ordered_languages = language_registry.load_ordered_languages(etym_dict, acceptable_modifiers, list_of_languages, etym_file=etym_file)
+		print "Languages cleaned"
+		instrumentation.set_gauge("stage_seconds", time.time() - stage_start, stage="load")
+		stage_start = time.time()
+
+		# tokenize the data and compile the word -> language index lookups once, so that making the vectors for each variation is just a gather
+		subjective_tokens = utils.tokenize_content(subjective_content)
+		objective_tokens = utils.tokenize_content(objective_content)
+		language_table = utils.compile_language_table(etym_dict, ordered_languages, acceptable_modifiers, list_of_languages)
+		if args.lemmatize == "sentence":
+			# every line is tagged in context and each token is looked up by its lemma in the language table
+			subjective_lemmas = utils.lemmatize_content(subjective_tokens)
+			objective_lemmas = utils.lemmatize_content(objective_tokens)
+			token_table = language_table
+			print "Lemmatized in context"
+		else:
+			# every distinct token is tagged on its own and mapped to the entry of its lemma
+			subjective_lemmas = None
+			objective_lemmas = None
+			token_table = utils.compile_token_table(subjective_tokens + objective_tokens, language_table)
+			print "Token table compiled"
+		# vectorize each file once, getting the matrices for every stopword/count/frequency variation at the same time
+		subjective_matrices = utils.get_feature_matrices(subjective_tokens, token_table, ordered_languages, stop_words, subjective_lemmas)
+		objective_matrices = utils.get_feature_matrices(objective_tokens, token_table, ordered_languages, stop_words, objective_lemmas)
+		print "Vectors created"
+
+		# the subjective and objective examples are stacked into one matrix per variation, with subjective examples labelled 1 and objective ones 0
+		num_subjective = subjective_matrices[(True, "count")][0].shape[0]
+		num_objective = objective_matrices[(True, "count")][0].shape[0]
+		labels = np.concatenate((np.ones(num_subjective, dtype=int), np.zeros(num_objective, dtype=int)))
+		for headers, setting in variant_settings:
+			include_stopwords, freq_or_count, parameter = setting
+			subjective_vectors_first, subjective_vectors_all = subjective_matrices[(include_stopwords, freq_or_count)]
+			objective_vectors_first, objective_vectors_all = objective_matrices[(include_stopwords, freq_or_count)]
+			if parameter == "first language":
+				variant_matrices[setting] = sparse.vstack((subjective_vectors_first, objective_vectors_first), format="csr")
+			else:
+				variant_matrices[setting] = sparse.vstack((subjective_vectors_all, objective_vectors_all), format="csr")
+			if cache is not None:
+				cache.put(cache_keys[setting], variant_matrices[setting], labels)
+	instrumentation.set_gauge("stage_seconds", time.time() - stage_start, stage="vectorize")
+	stage_start = time.time()
+
+	num_folds = 10
+	# the folds are stratified, so the subjective and objective examples are each split into num_folds equal-sized bins and every fold tests one bin of each
+	# they're drawn from a seeded random generator, so runs with the same seed (serial or parallel) give the same scores
+	folds = utils.generate_folds(len(labels), num_folds, args.seed, labels)
+	variants = [(headers, variant_matrices[setting]) for headers, setting in variant_settings]
+
+	# every fold of every variation is independent, so they're run across a pool of processes and the scores are collected in order
+	print "Running %d folds for %d variations on %d processes" % (num_folds, len(variants), args.processes)
+	backends = args.backends.split(",")
+	if args.search:
+		# search the hyperparameters of each backend for every variation, finding the best configuration over every fold,
+		# and scoring each fold with the configuration picked on the other folds
+		num_features = variants[0][1].shape[1]
+		grids = dict((backend, hyperparameter_search.make_grid(backend, num_features, parse_values(args.search_c), parse_values(args.search_alpha), parse_values(args.search_gamma_scales)))
+			for backend in backends)
+		print "Searching %s configurations with nested cross validation and successive halving (eta %d)" % (", ".join("%d %s" % (len(grids[backend]), backend) for backend in backends), args.search_eta)
+		scores, best_configs, picked_configs = hyperparameter_search.run_search([variant[1] for variant in variants], labels, folds, args.processes, backends, grids,
+			args.search_eta, args.search_min_folds, args.max_gram_mb)
+	else:
+		instrumentation.set_gauge("folds_total", num_folds * len(variants) * len(backends))
+		scores = utils.run_cross_validation([variant[1] for variant in variants], labels, folds, args.processes, backends)
+		best_configs = None
+	instrumentation.set_gauge("stage_seconds", time.time() - stage_start, stage="cross_validation")
+	for permutation_counter, (variant, variant_scores) in enumerate(zip(variants, scores)):
+		for header in variant[0]:
+			print header
+			output.write(header + "\n")
+		# with a search, the best configuration of each backend goes before the scores, followed by the configurations the scores come from
+		# (each fold is scored with the configuration picked on the other folds)
+		if best_configs is not None:
+			for backend, config, configs in zip(backends, best_configs[permutation_counter], picked_configs[permutation_counter]):
+				for header in ["-------Best configuration (%s): %s-------" % (backend, hyperparameter_search.format_config(backend, config)),
+						"-------Scored with the configuration picked on the other folds (%s): %s-------" % (backend, hyperparameter_search.format_configs(backend, configs))]:
+					print header
+					output.write(header + "\n")
+		print "--Perumutation %d--" % permutation_counter
+		for fold in range(num_folds):
+			# with one backend the results are written the same way as always, with more they're written side by side
+			if len(backends) == 1:
+				result = "f1_score: %.3f\n" % variant_scores[0][fold][0]
+			else:
+				result = "\t".join("f1_score (%s): %.3f" % (backend, backend_scores[fold][0]) for backend, backend_scores in zip(backends, variant_scores)) + "\n"
+			print result
+			output.write(result)
+		# the total time spent training and predicting across the folds for each backend
+		result = "\t".join("fit/predict time (%s): %.1f seconds" % (backend, sum(seconds for f1, seconds in backend_scores)) for backend, backend_scores in zip(backends, variant_scores)) + "\n"
+		print result
+		if len(backends) > 1:
+			output.write(result)
+	output.close()
+
+	total_time = time.time() - start_time
+	print "time elapsed: %d minutes" % (total_time / 60)
+	instrumentation.stop()
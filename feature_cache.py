@@ -0,0 +1,162 @@
+# coding=utf-8
+import os
+import argparse
+import hashlib
+import json
+import shutil
+import time
+import numpy as np
+from scipy import sparse
+
+
+# on-disk cache of feature matrices, so runs whose inputs haven't changed can skip tokenizing, lemmatizing and vectorizing
+# each entry is a directory named after the fingerprint of everything the matrix was made from, holding the parts of a CSR matrix and its labels
+# as .npy files (data.npy, indices.npy, indptr.npy, labels.npy) and a meta.json (written last, so a directory without one is an unfinished entry)
+# the .npy files are memory mapped when they're loaded, so loading an entry is nearly free and its pages are shared by the processes that use it
+# the time an entry was last used is the modification time of its meta.json, and the least recently used entries are evicted
+# once the cache is bigger than its size limit (never the entries this FeatureCache has stored or loaded, which the run is still using,
+# so a run whose matrices don't all fit keeps all of them and the cache goes back under its limit as later runs evict them)
+FEATURE_CACHE_DIR = "feature_cache"
+FEATURE_CACHE_FORMAT = "etymological-feature-cache"
+# bump this whenever a change to the vectorization changes the vectors it makes, so the old entries are no longer used
+FEATURE_CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+MATRIX_PARTS = ["data", "indices", "indptr"]
+
+
+# function that returns the sha1 of a file's contents (read in blocks, so big files aren't read into memory at once)
+def file_digest(path, block_size=1 << 20):
+	digest = hashlib.sha1()
+	with open(path, "rb") as input_file:
+		while True:
+			block = input_file.read(block_size)
+			if not block:
+				break
+			digest.update(block)
+	return digest.hexdigest()
+
+
+# function that returns the fingerprint of the inputs of a feature matrix (a dictionary of settings that can be written as json)
+# the inputs are written as json with sorted keys, so the same inputs always give the same fingerprint
+def fingerprint(inputs):
+	inputs = dict(inputs, feature_cache_version=FEATURE_CACHE_VERSION)
+	return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+# function that returns the inputs shared by all of the variations of the experiment's feature matrices:
+# the contents of the corpus files, the scraped etymologies and the language registry (if there is one), the languages the entries are cleaned with,
+# the stop words and how words are lemmatized
+# the variation's own settings (stopwords included or not, counts or frequencies, first or all languages) are added to these for each matrix
+def experiment_inputs(corpus_files, etym_file, registry_file, acceptable_modifiers, list_of_languages, stop_words, lemmatize):
+	return {
+		"corpus_files": [file_digest(corpus_file) for corpus_file in corpus_files],
+		"etym_file": file_digest(etym_file),
+		"registry_file": file_digest(registry_file) if os.path.exists(registry_file) else None,
+		"acceptable_modifiers": list(acceptable_modifiers),
+		"list_of_languages": list(list_of_languages),
+		"stop_words": sorted(stop_words),
+		"lemmatize": lemmatize,
+	}
+
+
+class FeatureCache(object):
+	def __init__(self, cache_dir=FEATURE_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		# the fingerprints of the entries stored or loaded through this FeatureCache
+		self.used_keys = set()
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+	def entry_dir(self, key):
+		return os.path.join(self.cache_dir, key)
+
+	# function that returns (matrix, labels) for a fingerprint, with the arrays memory mapped from the cache, or None if it isn't cached
+	def get(self, key):
+		entry_dir = self.entry_dir(key)
+		meta_file = os.path.join(entry_dir, "meta.json")
+		try:
+			meta = json.load(open(meta_file))
+		except (IOError, ValueError):
+			return None
+		if meta.get("format") != FEATURE_CACHE_FORMAT:
+			return None
+		parts = [np.load(os.path.join(entry_dir, part + ".npy"), mmap_mode="r") for part in MATRIX_PARTS]
+		labels = np.load(os.path.join(entry_dir, "labels.npy"), mmap_mode="r")
+		# mark the entry as just used, for the eviction
+		os.utime(meta_file, None)
+		self.used_keys.add(key)
+		return sparse.csr_matrix(tuple(parts), shape=tuple(meta["shape"]), copy=False), labels
+
+	# function that stores a matrix and its labels under a fingerprint, then evicts the least recently used entries if the cache is too big
+	# the entry is written to a temporary directory and renamed into place, so an entry is always complete
+	def put(self, key, matrix, labels):
+		matrix = sparse.csr_matrix(matrix)
+		entry_dir = self.entry_dir(key)
+		temp_dir = "%s.tmp-%d" % (entry_dir, os.getpid())
+		if os.path.isdir(temp_dir):
+			shutil.rmtree(temp_dir)
+		os.makedirs(temp_dir)
+		for part in MATRIX_PARTS:
+			np.save(os.path.join(temp_dir, part + ".npy"), getattr(matrix, part))
+		np.save(os.path.join(temp_dir, "labels.npy"), np.asarray(labels))
+		with open(os.path.join(temp_dir, "meta.json"), "w") as output:
+			json.dump({"format": FEATURE_CACHE_FORMAT, "version": FEATURE_CACHE_VERSION, "shape": list(matrix.shape), "created": time.time()}, output)
+		if os.path.isdir(entry_dir):
+			shutil.rmtree(entry_dir)
+		os.rename(temp_dir, entry_dir)
+		self.used_keys.add(key)
+		self.evict()
+
+	# function that returns (time last used, size in bytes, fingerprint) for every complete entry, least recently used first
+	def entries(self):
+		entries = []
+		for key in os.listdir(self.cache_dir):
+			entry_dir = self.entry_dir(key)
+			meta_file = os.path.join(entry_dir, "meta.json")
+			if not os.path.exists(meta_file):
+				continue
+			size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+			entries.append((os.path.getmtime(meta_file), size, key))
+		return sorted(entries)
+
+	# function that removes the least recently used entries until the cache is no bigger than max_bytes
+	# (never removing the entries in keep, or the ones stored or loaded through this FeatureCache)
+	# returns the fingerprints of the removed entries
+	def evict(self, keep=()):
+		entries = self.entries()
+		total_bytes = sum(size for last_used, size, key in entries)
+		evicted = []
+		for last_used, size, key in entries:
+			if total_bytes <= self.max_bytes:
+				break
+			if key in keep or key in self.used_keys:
+				continue
+			shutil.rmtree(self.entry_dir(key))
+			total_bytes -= size
+			evicted.append(key)
+		return evicted
+
+	# function that removes every entry
+	def clear(self):
+		for last_used, size, key in self.entries():
+			shutil.rmtree(self.entry_dir(key))
+
+
+# this file should be called from the command line as follows:
+# python feature_cache.py list|clear [--cache-dir DIR]
+# which lists the entries of the feature cache (least recently used first) or removes them all
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("command", choices=["list", "clear"])
+	parser.add_argument("--cache-dir", default=FEATURE_CACHE_DIR)
+	args = parser.parse_args()
+
+	cache = FeatureCache(args.cache_dir)
+	if args.command == "list":
+		entries = cache.entries()
+		for last_used, size, key in entries:
+			print "%s\t%.1f MB\tlast used %s" % (key, size / 1048576.0, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_used)))
+		print "%d entries, %.1f MB" % (len(entries), sum(size for last_used, size, key in entries) / 1048576.0)
+	else:
+		cache.clear()
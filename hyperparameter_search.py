@@ -0,0 +1,296 @@
+# coding=utf-8
+import math
+import collections
+import multiprocessing
+import time
+import numpy as np
+from scipy import sparse
+from sklearn import svm, metrics, kernel_approximation
+from sklearn.metrics import pairwise
+import etym_classifier_utils as utils
+import instrumentation
+
+
+# searches the hyperparameters of the classifier backends over the folds of the experiment, with successive halving:
+# every configuration is first scored on a few folds, only the best 1/eta of them go on to be scored on more folds, and so on until the ones left
+# are scored on every fold, so most of the time goes to the configurations that are worth it
+# the configuration left after searching every fold is the best configuration of the variant, but its scores on those folds are the ones it was
+# picked with, which overstates how well it does, so the scores reported come from nested cross validation: for each (outer) fold,
+# the configurations are also searched on the other folds (the inner folds, with the outer fold left out of every training set),
+# and the configuration picked is then trained on every fold but the outer one and scored on it, on data the search never saw
+# a configuration is (gamma, value), where value is C for "svm" and "linear_svm" and the regularization alpha for the "sgd" backends,
+# and gamma (the width of the RBF kernel, or of its approximation) is None for the backends that don't have a kernel
+# the work is split into tasks of (variant, outer fold, fold, backend, gamma, values), so the work that only depends on gamma is done once for all of its values:
+# for "svm" the Gram matrix of every example of the variant is computed once for each gamma, before the tasks that use it are handed to the
+# worker processes (which share it), and every C of every fold is fitted on the rows and columns of the fold's examples (kernel="precomputed"),
+# and for "sgd_rbf" and "sgd_nystroem" the vectors are mapped to the approximate kernel space once and every alpha is fitted on them
+# every alpha is fitted from scratch, the same way the backend is trained, so its score doesn't depend on which other alphas are searched with it
+
+# the values searched by default: C for "svm" and "linear_svm", alpha for the "sgd" backends,
+# and gamma as multiples of 1 / the number of features (the gamma the default svm uses)
+DEFAULT_C_VALUES = [0.1, 1.0, 10.0, 100.0]
+DEFAULT_ALPHA_VALUES = [0.00001, 0.0001, 0.001]
+DEFAULT_GAMMA_SCALES = [0.1, 1.0, 10.0]
+# the Gram matrix of a variant takes 8 bytes per pair of examples, so variants whose Gram matrix doesn't fit in this many MB
+# fit each C with the kernel computed by libsvm instead
+MAX_GRAM_MB = 1024
+# the number of passes over the training data of each alpha (as for the sgd backends in run_cross_validation)
+NUM_EPOCHS = 5
+
+# the data for the search tasks, set by run_search right before the worker processes are started (which inherit it, as in run_cross_validation)
+search_data = []
+search_labels = None
+search_folds = []
+search_max_gram_mb = MAX_GRAM_MB
+# ((variant, gamma), Gram matrix of every example of the variant) for the svm tasks being run, or None
+search_gram = None
+
+instrumentation.describe("search_fits_total", "Configurations fitted and scored on a fold by the hyperparameter search")
+
+
+# function that returns the name of the value searched for a backend
+def value_name(backend):
+	if backend in ["svm", "linear_svm"]:
+		return "C"
+	return "alpha"
+
+
+# function that formats a configuration for the results
+def format_config(backend, config):
+	gamma, value = config
+	if gamma is None:
+		return "%s=%g" % (value_name(backend), value)
+	return "%s=%g, gamma=%g" % (value_name(backend), value, gamma)
+
+
+# function that returns the configurations to search for a backend, given the number of features of the vectors
+def make_grid(backend, num_features, c_values=DEFAULT_C_VALUES, alpha_values=DEFAULT_ALPHA_VALUES, gamma_scales=DEFAULT_GAMMA_SCALES):
+	values = c_values if value_name(backend) == "C" else alpha_values
+	if backend in ["linear_svm", "sgd"]:
+		gammas = [None]
+	else:
+		gammas = [scale / float(num_features) for scale in gamma_scales]
+	return [(gamma, value) for gamma in gammas for value in values]
+
+
+# function that returns how many folds the configurations left are scored on at each rung of successive halving:
+# min_folds at first, then eta times as many at each rung, ending with every fold
+def fold_schedule(num_folds, min_folds=2, eta=3):
+	schedule = []
+	rung_folds = max(1, min(min_folds, num_folds))
+	while rung_folds < num_folds:
+		schedule.append(rung_folds)
+		rung_folds *= eta
+	schedule.append(num_folds)
+	return schedule
+
+
+# function that fits and scores every value of a backend with the same gamma on one fold
+# with precomputed, the data for "svm" are the kernel values of the training and testing examples against the training examples
+# returns a list of (value, f1 score, seconds spent fitting and predicting) in the order of values
+def score_values(training_data, training_labels, testing_data, testing_labels, backend, gamma, values, precomputed=False):
+	scores = []
+	if backend == "svm":
+		for C in values:
+			start_time = time.time()
+			if precomputed:
+				classifier = svm.SVC(C=C, kernel="precomputed")
+			else:
+				classifier = svm.SVC(C=C, gamma=gamma)
+			classifier.fit(training_data, training_labels)
+			predictions = classifier.predict(testing_data)
+			scores.append((C, metrics.f1_score(testing_labels, predictions), time.time() - start_time))
+	elif backend == "linear_svm":
+		for C in values:
+			start_time = time.time()
+			classifier = svm.LinearSVC(C=C, random_state=0)
+			classifier.fit(training_data, training_labels)
+			predictions = classifier.predict(testing_data)
+			scores.append((C, metrics.f1_score(testing_labels, predictions), time.time() - start_time))
+	else:
+		start_time = time.time()
+		# the vectors are mapped to the approximate kernel space once (the mapping only depends on gamma), rather than batch by batch for every alpha
+		if backend == "sgd_rbf":
+			transformer = kernel_approximation.RBFSampler(gamma=gamma, n_components=500, random_state=0)
+		elif backend == "sgd_nystroem":
+			transformer = kernel_approximation.Nystroem(gamma=gamma, n_components=500, random_state=0)
+		else:
+			transformer = None
+		if transformer is not None:
+			training_data = transformer.fit_transform(training_data)
+			testing_data = transformer.transform(testing_data)
+		transform_seconds = time.time() - start_time
+		for alpha in values:
+			start_time = time.time()
+			classifier = utils.IncrementalClassifier(num_epochs=NUM_EPOCHS, alpha=alpha, seed=0)
+			classifier.fit(training_data, training_labels)
+			predictions = classifier.predict(testing_data)
+			scores.append((alpha, metrics.f1_score(testing_labels, predictions), time.time() - start_time + transform_seconds / len(values)))
+	return scores
+
+
+# function that formats the configurations picked on each outer fold for the results, e.g. "C=1, gamma=0.1 (folds 0, 2); C=10, gamma=0.1 (fold 1)"
+def format_configs(backend, configs):
+	folds_by_config = []
+	for fold, config in enumerate(configs):
+		for picked_config, picked_folds in folds_by_config:
+			if picked_config == config:
+				picked_folds.append(fold)
+				break
+		else:
+			folds_by_config.append((config, [fold]))
+	return "; ".join("%s (fold%s %s)" % (format_config(backend, config), "s" if len(picked_folds) > 1 else "", ", ".join(str(fold) for fold in picked_folds))
+		for config, picked_folds in folds_by_config)
+
+
+# function that returns the training and testing indices of a fold for a search task: the testing indices are the fold's, and the training indices are
+# those of every other fold except the outer fold (with outer_fold None, every other fold)
+def get_indices_for_task(outer_fold, fold):
+	num_examples = len(search_labels)
+	left_out = utils.get_fold_mask(search_folds[fold], num_examples)
+	if outer_fold is not None:
+		left_out |= utils.get_fold_mask(search_folds[outer_fold], num_examples)
+	return np.flatnonzero(~left_out), np.asarray(search_folds[fold])
+
+
+# function that runs one search task, given as (variant, outer fold, fold, backend, gamma, values), and returns the task with the scores of its values
+# svm tasks are fitted on the rows and columns of the shared Gram matrix if there is one for their variant and gamma
+def evaluate_task(task):
+	variant, outer_fold, fold, backend, gamma, values = task
+	training_indices, testing_indices = get_indices_for_task(outer_fold, fold)
+	labels = np.asarray(search_labels)
+	if backend == "svm" and search_gram is not None and search_gram[0] == (variant, gamma):
+		gram = search_gram[1]
+		training_data = gram[np.ix_(training_indices, training_indices)]
+		testing_data = gram[np.ix_(testing_indices, training_indices)]
+		precomputed = True
+	else:
+		training_data = search_data[variant][training_indices]
+		testing_data = search_data[variant][testing_indices]
+		precomputed = False
+	return task, score_values(training_data, labels[training_indices], testing_data, labels[testing_indices], backend, gamma, values, precomputed)
+
+
+# function that runs search tasks on num_processes processes (forked after the data they need is set, so they inherit it) and returns each task with its scores
+def evaluate_tasks(tasks, num_processes):
+	if num_processes == 1:
+		return [evaluate_task(task) for task in tasks]
+	pool = multiprocessing.Pool(num_processes)
+	try:
+		return pool.map(evaluate_task, tasks, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+
+# function that returns whether the Gram matrix of every example of a variant fits in search_max_gram_mb
+def gram_fits(variant):
+	return search_data[variant].shape[0] ** 2 * 8 <= search_max_gram_mb * 1024 * 1024
+
+
+# function that runs search tasks and returns each task with its scores
+# the svm tasks that share a (variant, gamma) are run together, after the Gram matrix of every example of the variant with that gamma
+# is computed in this process (so the worker processes forked for them share it), if it fits; the other tasks are run together without one
+def run_tasks(tasks, num_processes):
+	global search_gram
+	groups = collections.OrderedDict()
+	for task in tasks:
+		variant, outer_fold, fold, backend, gamma, values = task
+		gram_key = (variant, gamma) if backend == "svm" and gram_fits(variant) else None
+		groups.setdefault(gram_key, []).append(task)
+	results = []
+	for gram_key, group_tasks in groups.items():
+		gram_seconds = 0.0
+		if gram_key is not None:
+			start_time = time.time()
+			variant, gamma = gram_key
+			data = search_data[variant]
+			search_gram = (gram_key, pairwise.rbf_kernel(data.toarray() if sparse.issparse(data) else data, gamma=gamma))
+			gram_seconds = time.time() - start_time
+		try:
+			group_results = evaluate_tasks(group_tasks, num_processes)
+		finally:
+			search_gram = None
+		# the time spent on the Gram matrix is split between the values that share it
+		num_values = sum(len(task[5]) for task in group_tasks)
+		for task, scores in group_results:
+			results.append((task, [(value, f1, seconds + gram_seconds / num_values) for value, f1, seconds in scores]))
+	return results
+
+
+# function that searches the configurations of every backend for every variant of the experiment
+# variants, labels and folds are as in run_cross_validation, and grids maps each backend to its configurations (see make_grid)
+# the configurations are halved separately for each (variant, backend) over every fold, and for each (variant, backend, outer fold) over the inner folds,
+# keeping the best 1/eta (by mean f1 score over the folds so far) at each rung; the one picked for each outer fold is then scored on it
+# returns (scores, best configurations, picked configurations): the scores are the (f1 score, seconds) on every outer fold of the configuration picked for it,
+# laid out like the results of run_cross_validation (variant, then backend, then fold), the best configurations are the ones left after searching
+# every fold, laid out the same way without the folds, and the picked configurations are laid out like the scores
+def run_search(variants, labels, folds, num_processes, backends, grids, eta=3, min_folds=2, max_gram_mb=MAX_GRAM_MB):
+	global search_data, search_labels, search_folds, search_max_gram_mb
+	search_data = variants
+	search_labels = labels
+	search_folds = folds
+	search_max_gram_mb = max_gram_mb
+	outer_folds = range(len(folds))
+	# the folds each search scores its configurations on: every fold for the search of the best configuration (outer fold None),
+	# and all of the others for the search of each outer fold
+	search_folds_of = dict((outer_fold, [fold for fold in range(len(folds)) if fold != outer_fold]) for outer_fold in outer_folds)
+	search_folds_of[None] = range(len(folds))
+	schedules = dict((outer_fold, fold_schedule(len(fold_list), min_folds, eta)) for outer_fold, fold_list in search_folds_of.items())
+	# (variant, backend, outer fold) -> the configurations still in the running
+	candidates = dict(((variant, backend, outer_fold), list(grids[backend])) for variant in range(len(variants)) for backend in backends for outer_fold in search_folds_of)
+	# (variant, backend, outer fold, configuration) -> {fold: (f1 score, seconds)}
+	fold_scores = collections.defaultdict(dict)
+	for rung in range(max(len(schedule) for schedule in schedules.values())):
+		tasks = []
+		for (variant, backend, outer_fold), configs in sorted(candidates.items()):
+			if rung >= len(schedules[outer_fold]):
+				continue
+			# the configurations that share a gamma are scored together, in one task per fold
+			gammas = []
+			for gamma, value in configs:
+				if gamma not in gammas:
+					gammas.append(gamma)
+			for fold in search_folds_of[outer_fold][:schedules[outer_fold][rung]]:
+				for gamma in gammas:
+					values = [value for config_gamma, value in configs if config_gamma == gamma and fold not in fold_scores[(variant, backend, outer_fold, (config_gamma, value))]]
+					if values:
+						tasks.append((variant, outer_fold, fold, backend, gamma, values))
+		for (variant, outer_fold, fold, backend, gamma, values), scores in run_tasks(tasks, num_processes):
+			for value, f1, seconds in scores:
+				fold_scores[(variant, backend, outer_fold, (gamma, value))][fold] = (f1, seconds)
+			instrumentation.increment("search_fits_total", len(scores), backend=backend)
+		# keep the best configurations (ties keep the order they were already in), or just the best one after the last rung
+		for key, configs in candidates.items():
+			schedule = schedules[key[2]]
+			if rung >= len(schedule):
+				continue
+			rung_folds = search_folds_of[key[2]][:schedule[rung]]
+			ranked = sorted(configs, key=lambda config: -np.mean([fold_scores[key + (config,)][fold][0] for fold in rung_folds]))
+			if rung < len(schedule) - 1:
+				candidates[key] = ranked[:int(math.ceil(len(configs) / float(eta)))]
+			else:
+				candidates[key] = ranked[:1]
+	# score the configuration picked for each outer fold on it, trained on every other fold
+	# (the same task as scoring it on that fold in the search of the best configuration, so it's only run if that search didn't already)
+	tasks = []
+	for (variant, backend, outer_fold), configs in sorted(candidates.items()):
+		if outer_fold is not None and outer_fold not in fold_scores[(variant, backend, None, configs[0])]:
+			gamma, value = configs[0]
+			tasks.append((variant, None, outer_fold, backend, gamma, [value]))
+	for (variant, outer_fold, fold, backend, gamma, values), scores in run_tasks(tasks, num_processes):
+		fold_scores[(variant, backend, None, (gamma, values[0]))][fold] = scores[0][1:]
+		instrumentation.increment("search_fits_total", len(scores), backend=backend)
+	scores = []
+	best_configs = []
+	picked_configs = []
+	for variant in range(len(variants)):
+		scores.append([])
+		best_configs.append([])
+		picked_configs.append([])
+		for backend in backends:
+			picked = [candidates[(variant, backend, outer_fold)][0] for outer_fold in outer_folds]
+			scores[-1].append([fold_scores[(variant, backend, None, config)][outer_fold] for outer_fold, config in zip(outer_folds, picked)])
+			best_configs[-1].append(candidates[(variant, backend, None)][0])
+			picked_configs[-1].append(picked)
+	return scores, best_configs, picked_configs
@@ -0,0 +1,68 @@
+# coding=utf-8
+import sys
+import os
+import argparse
+import json
+import time
+import threading
+import httplib
+
+
+# function that keeps sending sentences (one per request) to the server over one connection until end_time,
+# and adds the latency of each request to latencies
+def run_client(host, port, sentences, offset, end_time, latencies, errors):
+	connection = httplib.HTTPConnection(host, port)
+	i = offset
+	while time.time() < end_time:
+		body = json.dumps({"sentence": sentences[i % len(sentences)]})
+		start_time = time.time()
+		try:
+			connection.request("POST", "/predict", body, {"Content-Type": "application/json"})
+			response = connection.getresponse()
+			response.read()
+			if response.status != 200:
+				errors.append(response.status)
+		except (httplib.HTTPException, IOError) as e:
+			errors.append(str(e))
+			connection.close()
+			connection = httplib.HTTPConnection(host, port)
+		latencies.append(time.time() - start_time)
+		i += 1
+	connection.close()
+
+
+# this file should be called from the command line as follows, with inference_server.py already running:
+# python inference_load_test.py [--host H] [--port P] [--clients N] [--seconds S] [<sentences_file>]
+# it sends the sentences in the file (defaults to the subjective rotten_imdb data) from N concurrent clients for S seconds,
+# then prints the throughput and latencies it saw along with the server's own counters
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("sentences_file", nargs="?", default=os.getcwd() + "/rotten_imdb/quote.tok.gt9.5000")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--clients", type=int, default=32)
+	parser.add_argument("--seconds", type=float, default=10.0)
+	args = parser.parse_args()
+
+	# the rotten_imdb data isn't utf-8, so read it as latin-1 to be able to send any line as json
+	sentences = [line.rstrip().decode("latin-1") for line in open(args.sentences_file).readlines()]
+	# each client appends to its own list, so the clients don't contend with each other for a lock
+	latencies = [[] for client in range(args.clients)]
+	errors = []
+	end_time = time.time() + args.seconds
+	threads = []
+	for client in range(args.clients):
+		thread = threading.Thread(target=run_client, args=(args.host, args.port, sentences, client * len(sentences) // args.clients, end_time, latencies[client], errors))
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		thread.join()
+
+	latencies = sorted(latency for client_latencies in latencies for latency in client_latencies)
+	print "%d requests from %d clients in %.1f seconds: %.0f sentences per second, %d errors" % (len(latencies), args.clients, args.seconds, len(latencies) / args.seconds, len(errors))
+	if latencies:
+		for name, percentile in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+			print "latency %s: %.2f ms" % (name, 1000 * latencies[min(len(latencies) - 1, int(percentile * len(latencies)))])
+	connection = httplib.HTTPConnection(args.host, args.port)
+	connection.request("GET", "/metrics")
+	print "server metrics: %s" % connection.getresponse().read()
@@ -0,0 +1,227 @@
+# coding=utf-8
+import sys
+import argparse
+import json
+import time
+import threading
+import Queue
+import BaseHTTPServer
+import SocketServer
+from subjectivity_classifier import SubjectivityClassifier
+
+
+# a request waiting to be classified as part of a micro-batch
+class PendingRequest(object):
+	def __init__(self, sentences):
+		self.sentences = sentences
+		self.labels = None
+		self.error = None
+		self.done = threading.Event()
+
+
+# counters for the requests the server has handled
+# latencies are kept for the most recent requests only, so percentiles reflect the current load
+class ServerMetrics(object):
+	def __init__(self, num_recent=10000):
+		self.lock = threading.Lock()
+		self.start_time = time.time()
+		self.requests = 0
+		self.sentences = 0
+		self.batches = 0
+		self.errors = 0
+		self.max_batch_size = 0
+		self.recent_latencies = []
+		self.num_recent = num_recent
+		self.next_latency = 0
+
+	def record_batch(self, num_sentences):
+		with self.lock:
+			self.batches += 1
+			self.sentences += num_sentences
+			self.max_batch_size = max(self.max_batch_size, num_sentences)
+
+	def record_request(self, seconds, failed=False):
+		with self.lock:
+			self.requests += 1
+			if failed:
+				self.errors += 1
+			# the recent latencies are a ring buffer
+			if len(self.recent_latencies) < self.num_recent:
+				self.recent_latencies.append(seconds)
+			else:
+				self.recent_latencies[self.next_latency] = seconds
+				self.next_latency = (self.next_latency + 1) % self.num_recent
+
+	def snapshot(self):
+		with self.lock:
+			elapsed = time.time() - self.start_time
+			latencies = sorted(self.recent_latencies)
+			snapshot = {
+				"uptime_seconds": elapsed,
+				"requests": self.requests,
+				"sentences": self.sentences,
+				"batches": self.batches,
+				"errors": self.errors,
+				"max_batch_size": self.max_batch_size,
+				"mean_batch_size": float(self.sentences) / self.batches if self.batches else 0.0,
+				"sentences_per_second": self.sentences / elapsed if elapsed > 0 else 0.0,
+			}
+		for name, percentile in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+			if latencies:
+				snapshot["latency_%s_ms" % name] = 1000 * latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+			else:
+				snapshot["latency_%s_ms" % name] = 0.0
+		return snapshot
+
+
+# groups concurrent requests into micro-batches so the model's predict runs once per batch instead of once per request
+# a batch is started by the first waiting request and closes when it has max_batch_size sentences or max_wait seconds have passed
+# one thread runs the batches, so the classifier is only ever used from that thread
+class MicroBatcher(object):
+	def __init__(self, classifier, metrics, max_batch_size=256, max_wait=0.002):
+		self.classifier = classifier
+		self.metrics = metrics
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.queue = Queue.Queue()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	# function that classifies a list of sentences (blocking until its batch has run) and returns their labels
+	def classify(self, sentences):
+		request = PendingRequest(sentences)
+		self.queue.put(request)
+		request.done.wait()
+		if request.error is not None:
+			raise request.error
+		return request.labels
+
+	def run(self):
+		while True:
+			batch = [self.queue.get()]
+			num_sentences = len(batch[0].sentences)
+			deadline = time.time() + self.max_wait
+			while num_sentences < self.max_batch_size:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				try:
+					request = self.queue.get(timeout=remaining)
+				except Queue.Empty:
+					break
+				batch.append(request)
+				num_sentences += len(request.sentences)
+			self.run_batch(batch)
+
+	def run_batch(self, batch):
+		sentences = [sentence for request in batch for sentence in request.sentences]
+		try:
+			labels = self.classifier.predict_batch(sentences)
+		except Exception as e:
+			for request in batch:
+				request.error = e
+				request.done.set()
+			return
+		self.metrics.record_batch(len(sentences))
+		start = 0
+		for request in batch:
+			request.labels = labels[start:start + len(request.sentences)]
+			start += len(request.sentences)
+			request.done.set()
+
+
+# request handler for the inference server
+# POST /predict with {"sentence": "..."} or {"sentences": ["...", ...]} returns {"label": ...} or {"labels": [...]}
+# GET /metrics returns the server's counters and GET /health returns {"status": "ok"}
+class InferenceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# keep connections open between requests, so clients don't pay for a new connection every time
+	protocol_version = "HTTP/1.1"
+	# buffer each response and send it in one go, rather than writing the status line and every header separately
+	# (small separate writes on a kept-alive connection run into delayed acks and add tens of milliseconds to every request)
+	wbufsize = -1
+	disable_nagle_algorithm = True
+
+	def send_json(self, code, content):
+		body = json.dumps(content)
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == "/metrics":
+			self.send_json(200, self.server.metrics.snapshot())
+		elif self.path == "/health":
+			self.send_json(200, {"status": "ok"})
+		else:
+			self.send_json(404, {"error": "not found"})
+
+	def do_POST(self):
+		if self.path != "/predict":
+			self.send_json(404, {"error": "not found"})
+			return
+		start_time = time.time()
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+			single = "sentence" in request
+			sentences = [request["sentence"]] if single else request["sentences"]
+			if not isinstance(sentences, list):
+				raise ValueError("sentences should be a list")
+			for sentence in sentences:
+				if not isinstance(sentence, basestring):
+					raise TypeError("every sentence should be a string")
+			# the classifier works on byte strings, like the lines it was trained on
+			sentences = [sentence.encode("utf-8") if isinstance(sentence, unicode) else sentence for sentence in sentences]
+		except (ValueError, KeyError, TypeError, AttributeError) as e:
+			self.server.metrics.record_request(time.time() - start_time, failed=True)
+			self.send_json(400, {"error": "bad request: %s" % e})
+			return
+		try:
+			labels = self.server.batcher.classify(sentences)
+		except Exception as e:
+			self.server.metrics.record_request(time.time() - start_time, failed=True)
+			self.send_json(500, {"error": str(e)})
+			return
+		self.server.metrics.record_request(time.time() - start_time)
+		if single:
+			self.send_json(200, {"label": labels[0]})
+		else:
+			self.send_json(200, {"labels": labels})
+
+	def log_message(self, format, *args):
+		pass
+
+
+class InferenceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, classifier, max_batch_size=256, max_wait=0.002):
+		BaseHTTPServer.HTTPServer.__init__(self, address, InferenceHandler)
+		self.metrics = ServerMetrics()
+		self.batcher = MicroBatcher(classifier, self.metrics, max_batch_size, max_wait)
+
+
+# this file should be called from the command line as follows:
+# python inference_server.py <model_file> [--host H] [--port P] [--max-batch-size N] [--max-wait-ms MS]
+# where the model file was made by python subjectivity_classifier.py train <model_file>
+# the model is loaded once, and then sentences can be classified by posting them to http://<host>:<port>/predict
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("model_file")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--max-batch-size", type=int, default=256, help="most sentences predicted together in one batch")
+	parser.add_argument("--max-wait-ms", type=float, default=2.0, help="longest a request waits for others to join its batch")
+	args = parser.parse_args()
+
+	classifier = SubjectivityClassifier.load(args.model_file)
+	# classify a sentence before taking requests, so that the first request doesn't pay for loading the tokenizer and tagger
+	classifier.predict("warming up the classifier")
+	server = InferenceServer((args.host, args.port), classifier, args.max_batch_size, args.max_wait_ms / 1000.0)
+	print "Serving %s on http://%s:%d/predict" % (args.model_file, args.host, server.server_address[1])
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,219 @@
+# coding=utf-8
+import os
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+# lightweight counters, gauges and histograms for watching long runs (tokens processed, lookups that missed, sentences skipped, fetch latency...)
+# everything is off until enable() is called: until then every function returns straight away, so instrumented code costs next to nothing,
+# and code in tight loops can check instrumentation.enabled before doing any extra work to count things
+# the values are exported in the Prometheus text format, to a file that's rewritten every few seconds and/or from an http endpoint
+# metrics are per process, so work done in pool worker processes should be counted by the parent from what the workers return
+enabled = False
+lock = threading.Lock()
+# name -> {labels -> value}, where labels is a sorted tuple of (label, value) pairs
+counters = {}
+gauges = {}
+# name -> {labels -> [bucket counts, sum, count]}
+histograms = {}
+histogram_buckets = {}
+help_texts = {}
+exporters = []
+
+# the default buckets of a histogram, suited to durations in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+
+
+# function that turns the labels of a metric into a key
+def label_key(labels):
+	if not labels:
+		return ()
+	return tuple(sorted(labels.items()))
+
+
+# function that turns on collecting metrics
+def enable():
+	global enabled
+	enabled = True
+
+
+# function that sets the help text of a metric and, for a histogram, its buckets (which should be sorted)
+# this can be called whether or not metrics are enabled, and should be called before the metric is first used
+def describe(name, help_text, buckets=None):
+	help_texts[name] = help_text
+	if buckets is not None:
+		histogram_buckets[name] = tuple(buckets)
+
+
+# function that adds value to a counter
+def increment(name, value=1, **labels):
+	if not enabled:
+		return
+	key = label_key(labels)
+	with lock:
+		values = counters.setdefault(name, {})
+		values[key] = values.get(key, 0) + value
+
+
+# function that sets a gauge (a value that can go up and down, e.g. the number of words still to scrape)
+def set_gauge(name, value, **labels):
+	if not enabled:
+		return
+	with lock:
+		gauges.setdefault(name, {})[label_key(labels)] = value
+
+
+# function that adds an observation (e.g. a duration in seconds) to a histogram
+def observe(name, value, **labels):
+	if not enabled:
+		return
+	buckets = histogram_buckets.get(name, DEFAULT_BUCKETS)
+	key = label_key(labels)
+	with lock:
+		values = histograms.setdefault(name, {})
+		if key not in values:
+			values[key] = [[0] * len(buckets), 0.0, 0]
+		histogram = values[key]
+		for i, bound in enumerate(buckets):
+			if value <= bound:
+				histogram[0][i] += 1
+				break
+		histogram[1] += value
+		histogram[2] += 1
+
+
+# times a block of code into a histogram of seconds:
+#   with instrumentation.timer("vectorize_seconds"):
+#       ...
+class timer(object):
+	def __init__(self, name, **labels):
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.start_time = time.time()
+		return self
+
+	def __exit__(self, exception_type, exception, traceback):
+		self.seconds = time.time() - self.start_time
+		observe(self.name, self.seconds, **self.labels)
+		return False
+
+
+# function that formats the labels of a metric for the Prometheus text format
+def format_labels(key, extra=()):
+	pairs = list(key) + list(extra)
+	if not pairs:
+		return ""
+	return "{%s}" % ",".join('%s="%s"' % (label, str(value).replace("\\", "\\\\").replace('"', '\\"')) for label, value in pairs)
+
+
+# function that returns every metric in the Prometheus text format
+def render():
+	lines = []
+	with lock:
+		for kind, metrics in [("counter", counters), ("gauge", gauges)]:
+			for name in sorted(metrics):
+				if name in help_texts:
+					lines.append("# HELP %s %s" % (name, help_texts[name]))
+				lines.append("# TYPE %s %s" % (name, kind))
+				for key in sorted(metrics[name]):
+					lines.append("%s%s %s" % (name, format_labels(key), repr(float(metrics[name][key]))))
+		for name in sorted(histograms):
+			buckets = histogram_buckets.get(name, DEFAULT_BUCKETS)
+			if name in help_texts:
+				lines.append("# HELP %s %s" % (name, help_texts[name]))
+			lines.append("# TYPE %s histogram" % name)
+			for key in sorted(histograms[name]):
+				bucket_counts, total, count = histograms[name][key]
+				# the buckets are cumulative in the Prometheus format
+				cumulative = 0
+				for bound, bucket_count in zip(buckets, bucket_counts):
+					cumulative += bucket_count
+					lines.append("%s_bucket%s %d" % (name, format_labels(key, [("le", repr(bound))]), cumulative))
+				lines.append("%s_bucket%s %d" % (name, format_labels(key, [("le", "+Inf")]), count))
+				lines.append("%s_sum%s %s" % (name, format_labels(key), repr(total)))
+				lines.append("%s_count%s %d" % (name, format_labels(key), count))
+	return "\n".join(lines) + "\n"
+
+
+# function that writes the metrics to a file (through a temporary file, so a reader never sees a half written file)
+def write_metrics_file(metrics_file):
+	temp_file = metrics_file + ".tmp"
+	with open(temp_file, "w") as output:
+		output.write(render())
+	os.rename(temp_file, metrics_file)
+
+
+# rewrites the metrics file every interval seconds from a background thread, until stopped (which writes it one last time)
+class FileExporter(object):
+	def __init__(self, metrics_file, interval=10.0):
+		self.metrics_file = metrics_file
+		self.interval = interval
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			write_metrics_file(self.metrics_file)
+
+	def stop(self):
+		self.stopped.set()
+		self.thread.join()
+		write_metrics_file(self.metrics_file)
+
+
+# request handler that serves the metrics at /metrics
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		body = render()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+
+# serves the metrics over http from a background thread, until stopped
+class HttpExporter(object):
+	def __init__(self, port, host="127.0.0.1"):
+		self.server = MetricsServer((host, port), MetricsHandler)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+# function that turns on collecting metrics and starts exporting them to metrics_file and/or on http://host:port/metrics
+# does nothing if neither is given, so it can be called straight from command line options
+def start(metrics_file=None, port=None, interval=10.0, host="127.0.0.1"):
+	if metrics_file is None and port is None:
+		return
+	enable()
+	if metrics_file is not None:
+		exporters.append(FileExporter(metrics_file, interval))
+	if port is not None:
+		exporters.append(HttpExporter(port, host))
+
+
+# function that stops the exporters (writing the metrics file a final time)
+def stop():
+	while exporters:
+		exporters.pop().stop()
@@ -0,0 +1,57 @@
+# coding=utf-8
+import re
+from nltk import word_tokenize
+
+
+# a phrase made only of letters and hyphens, with single spaces between the words
+# word_tokenize leaves words like these whole (the only ones it splits are contractions like "cannot", which are never languages or modifiers either way),
+# so splitting these phrases on spaces gives the same words as word_tokenize, without running the tokenizer
+SIMPLE_PHRASE = re.compile(r"[A-Za-z-]+( [A-Za-z-]+)*\Z")
+
+
+# normalizes the language phrases of etymology entries to the languages they name, giving exactly the same result as clean_entry
+# the acceptable modifiers and list of languages are compiled into one set, so checking a word is a single hash lookup instead of a scan of both lists,
+# and the result for every phrase is memoized, so each distinct phrase is only cleaned once however many entries it's in
+class LanguageNormalizer(object):
+	def __init__(self, acceptable_modifiers, list_of_languages):
+		self.accepted_words = frozenset(acceptable_modifiers) | frozenset(list_of_languages)
+		self.normalized = {}
+
+	# function that decides whether a word of a phrase is kept (a language, an acceptable modifier, or part of a "Proto-" language)
+	def accepts(self, word):
+		return word in self.accepted_words or "Proto" in word
+
+	# function that returns the phrase with any words that aren't languages or acceptable modifiers removed ("" if there aren't any)
+	def normalize(self, phrase):
+		try:
+			return self.normalized[phrase]
+		except KeyError:
+			pass
+		if SIMPLE_PHRASE.match(phrase):
+			words = phrase.split(" ")
+		else:
+			words = word_tokenize(phrase)
+		normalized = " ".join(word for word in words if self.accepts(word))
+		self.normalized[phrase] = normalized
+		return normalized
+
+	def __call__(self, phrase):
+		return self.normalize(phrase)
+
+
+# function that finds the language phrase at the start of a branch of an etymology entry (the tokens after a "from")
+# languages are capitalized, including any modifiers (e.g. "Old Norse"), so the phrase is the first token followed by the capitalized words after it
+# returns None if the branch doesn't start with a language (it starts with a lowercase word, or with a date)
+def take_language_phrase(tokens):
+	first = tokens[0]
+	if any(char.isdigit() for char in first) or first[0].isupper() == False:
+		return None
+	# (first + " " + the following words).istitle() holds exactly when first is in title case and none of the following words break title case
+	# (which is what ("A " + word).istitle() checks), so the words can be checked one at a time instead of checking the whole phrase again for every word added
+	if not first.istitle():
+		return first
+	# things can get wonky when other characters like "ænlic" are included so also check that each word is only letters
+	end = 1
+	while end < len(tokens) and tokens[end].isalpha() and ("A " + tokens[end]).istitle():
+		end += 1
+	return " ".join(tokens[:end])
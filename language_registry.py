@@ -0,0 +1,181 @@
+# coding=utf-8
+import sys
+import os
+import argparse
+import collections
+import time
+import etym_classifier_utils as utils
+import etym_store
+from language_normalizer import LanguageNormalizer
+
+
+# the default location of the registry, next to the scraped etymologies
+REGISTRY_FILE = "languages.registry"
+REGISTRY_HEADER = "column\tlanguage\tcount\n"
+
+
+# an append-only registry of the (cleaned) languages that are the columns of the vectors
+# every language keeps the column it was given when it was first seen, and new languages are only ever added at the end,
+# so adding words never moves a column and a model trained on the first N columns can keep using the first N columns of new vectors
+# the registry also keeps the count of each language (how many times a phrase that cleans to it appears in the etymologies, as in get_cleaned_languages),
+# which is updated word by word, so folding new entries in only costs as much as the new entries
+class LanguageRegistry(object):
+	def __init__(self, acceptable_modifiers, list_of_languages, registry_file=REGISTRY_FILE):
+		self.acceptable_modifiers = acceptable_modifiers
+		self.list_of_languages = list_of_languages
+		self.registry_file = registry_file
+		self.languages = []
+		self.columns = {}
+		self.counts = []
+		# remembers what each phrase cleans to (the same phrases show up in many entries)
+		self.normalizer = LanguageNormalizer(acceptable_modifiers, list_of_languages)
+
+	# function that loads a registry saved with save
+	@classmethod
+	def load(cls, acceptable_modifiers, list_of_languages, registry_file=REGISTRY_FILE):
+		registry = cls(acceptable_modifiers, list_of_languages, registry_file)
+		registry_lines = open(registry_file).readlines()
+		if not registry_lines or registry_lines[0] != REGISTRY_HEADER:
+			raise ValueError("%s is not a language registry" % registry_file)
+		for line in registry_lines[1:]:
+			column, lang, count = line.rstrip("\n").split("\t")
+			if int(column) != len(registry.languages):
+				raise ValueError("%s has column %s out of order" % (registry_file, column))
+			registry.columns[lang] = len(registry.languages)
+			registry.languages.append(lang)
+			registry.counts.append(int(count))
+		return registry
+
+	# function that builds a registry from a whole etymology dictionary
+	# the languages are given columns in sorted order, so a new registry has the same columns as get_ordered_languages
+	@classmethod
+	def build(cls, etym_dict, acceptable_modifiers, list_of_languages, registry_file=REGISTRY_FILE):
+		registry = cls(acceptable_modifiers, list_of_languages, registry_file)
+		for lang in utils.get_ordered_languages(etym_dict, acceptable_modifiers, list_of_languages):
+			registry.add_language(lang)
+		registry.recount(etym_dict)
+		return registry
+
+	# function that saves the registry (it's small, a line per language, so it's just rewritten)
+	def save(self):
+		temp_file = self.registry_file + ".tmp"
+		with open(temp_file, "w") as output:
+			output.write(REGISTRY_HEADER)
+			for column, (lang, count) in enumerate(zip(self.languages, self.counts)):
+				output.write("%d\t%s\t%d\n" % (column, lang, count))
+		os.rename(temp_file, self.registry_file)
+
+	# function that gives a language the next column if it doesn't have one yet, and returns its column
+	def add_language(self, lang):
+		if lang not in self.columns:
+			self.columns[lang] = len(self.languages)
+			self.languages.append(lang)
+			self.counts.append(0)
+		return self.columns[lang]
+
+	# function that returns what a phrase of an entry cleans to ("" if nothing in it is a language)
+	def clean_phrase(self, phrase):
+		try:
+			return self.normalizer.normalize(phrase)
+		except Exception as e:
+			return ""
+
+	# function that adds (sign 1) or removes (sign -1) the languages of one entry to the counts, adding any new languages
+	def count_entry(self, entry, sign):
+		for phrase in entry:
+			lang = self.clean_phrase(phrase)
+			if lang != "":
+				self.counts[self.add_language(lang)] += sign
+
+	# function that recounts every language from a whole etymology dictionary, keeping the columns the languages already have
+	def recount(self, etym_dict):
+		self.counts = [0] * len(self.languages)
+		for word, entry in etym_dict.items():
+			self.count_entry(entry, 1)
+
+	# function that folds new or rescraped entries (a dictionary of word -> languages) into the registry
+	# old_entries has the entries the words had before (e.g. the current etymology dictionary or store), so the counts of rescraped words are replaced
+	# only the new entries are looked at, and the words already in old_entries are looked up one at a time
+	# returns the list of languages that were given new columns
+	def ingest(self, new_entries, old_entries=None):
+		num_languages = len(self.languages)
+		for word, entry in new_entries.items():
+			old_entry = old_entries.get(word) if old_entries is not None else None
+			if old_entry is not None:
+				self.count_entry(old_entry, -1)
+			self.count_entry(entry, 1)
+		return self.languages[num_languages:]
+
+	# function that returns the languages in column order, with their counts, in place of get_ordered_languages
+	def ordered_languages(self):
+		return collections.OrderedDict(zip(self.languages, self.counts))
+
+
+# function that returns the ordered languages from the registry in registry_file if there is one, and otherwise sorted with get_ordered_languages
+# ingest saves the registry after appending to the etymology file, so a registry older than etym_file has missed entries that were written some other way
+# (e.g. by a rescrape): it's recounted from etym_dict (keeping its columns, as python language_registry.py build does) and saved before it's used
+def load_ordered_languages(etym_dict, acceptable_modifiers, list_of_languages, registry_file=REGISTRY_FILE, etym_file="scraped_etymologies.txt"):
+	if os.path.exists(registry_file):
+		registry = LanguageRegistry.load(acceptable_modifiers, list_of_languages, registry_file)
+		if os.path.exists(etym_file) and os.path.getmtime(registry_file) < os.path.getmtime(etym_file):
+			print >> sys.stderr, "%s is older than %s, recounting it" % (registry_file, etym_file)
+			registry.recount(etym_dict)
+			registry.save()
+		return registry.ordered_languages()
+	return utils.get_ordered_languages(etym_dict, acceptable_modifiers, list_of_languages)
+
+
+# function that appends entries to an etymology file in the same format the scraper writes
+# build_etym_dict keeps the last line for a word, so a rescraped word appended to the end replaces its old entry without rewriting the file
+def append_etymologies(etym_file, new_entries):
+	with open(etym_file, "a") as output:
+		for word, entry in new_entries.items():
+			output.write('{0}\t{1}\n'.format(word, str(entry)))
+
+
+# this file should be called from the command line as follows:
+# python language_registry.py build [--etym-file F] [--registry R]
+# which makes the registry from the whole etymology file (or recounts an existing one, keeping its columns), or:
+# python language_registry.py ingest <delta_file> [--etym-file F] [--registry R]
+# which folds the entries of a scrape delta (in the same format as scraped_etymologies.txt) into the registry and appends them to the etymology file
+# (and adds them to the etymology file's store, if it has one, so later loads still use it: see etym_store.update_store)
+if __name__ == "__main__":
+	start_time = time.time()
+	parser = argparse.ArgumentParser()
+	parser.add_argument("command", choices=["build", "ingest"])
+	parser.add_argument("delta_file", nargs="?")
+	parser.add_argument("--etym-file", default="scraped_etymologies.txt")
+	parser.add_argument("--registry", default=REGISTRY_FILE)
+	args = parser.parse_args()
+
+	list_of_languages = utils.read_list_of_languages(os.getcwd() + "/list_of_languages.txt")
+	if args.command == "build":
+		etym_dict = etym_store.load_etym_dict(args.etym_file)
+		if os.path.exists(args.registry):
+			registry = LanguageRegistry.load(utils.ACCEPTABLE_MODIFIERS, list_of_languages, args.registry)
+			num_languages = len(registry.languages)
+			registry.recount(etym_dict)
+			print "Recounted %d languages (%d new)" % (len(registry.languages), len(registry.languages) - num_languages)
+		else:
+			registry = LanguageRegistry.build(etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages, args.registry)
+			print "Registered %d languages" % len(registry.languages)
+	else:
+		if args.delta_file is None:
+			parser.error("ingest needs a delta file")
+		new_entries = utils.build_etym_dict(args.delta_file)
+		# the current entries are only needed for the words in the delta, which the memory mapped store can look up without loading everything
+		old_entries = etym_store.load_etym_dict(args.etym_file)
+		if os.path.exists(args.registry):
+			registry = LanguageRegistry.load(utils.ACCEPTABLE_MODIFIERS, list_of_languages, args.registry)
+		else:
+			registry = LanguageRegistry.build(old_entries, utils.ACCEPTABLE_MODIFIERS, list_of_languages, args.registry)
+		new_languages = registry.ingest(new_entries, old_entries)
+		append_etymologies(args.etym_file, new_entries)
+		store_update = etym_store.update_store(args.etym_file, old_entries, new_entries)
+		if store_update == "delta":
+			print "Added the entries to the etymology store's delta store"
+		elif store_update is not None:
+			print "Recompiled the etymology store (%s)" % store_update
+		print "Ingested %d entries, %d new languages: %s" % (len(new_entries), len(new_languages), ", ".join(new_languages))
+	registry.save()
+	print "time elapsed: %.2f seconds" % (time.time() - start_time)
@@ -0,0 +1,287 @@
+# coding=utf-8
+import sys
+import os
+import ast
+import time
+import random
+import hashlib
+import socket
+import httplib
+import threading
+import urllib2
+import urlparse
+import BaseHTTPServer
+from multiprocessing.pool import ThreadPool
+import instrumentation
+
+instrumentation.describe("http_fetch_seconds", "Time taken by each http request (including failed ones)", [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30])
+instrumentation.describe("http_requests_total", "Http requests made, by status")
+instrumentation.describe("http_retries_total", "Http requests that were retried")
+instrumentation.describe("cache_hits_total", "Pages served from the on-disk cache")
+instrumentation.describe("words_scraped_total", "Words scraped and recorded in the journal, by outcome")
+instrumentation.describe("words_remaining", "Words still to be scraped in this run")
+
+# error raised when a page couldn't be fetched even after retrying
+# words whose pages fail like this aren't recorded in the journal, so they're tried again the next time the scrape is run
+class FetchError(Exception):
+	pass
+
+
+# on-disk cache of fetched pages
+# the pages are content addressed: the body of a page is stored under the sha1 of its content (so identical pages are only stored once),
+# and each url just points to the hash of its content (or to MISSING if the page doesn't exist)
+# entries are written to a temporary file and renamed into place, so a crash never leaves a partial entry behind
+class HttpCache(object):
+	MISSING = "missing"
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		for subdir in ["objects", "urls"]:
+			if not os.path.isdir(os.path.join(cache_dir, subdir)):
+				os.makedirs(os.path.join(cache_dir, subdir))
+
+	def url_path(self, url):
+		return os.path.join(self.cache_dir, "urls", hashlib.sha1(url).hexdigest())
+
+	def object_path(self, digest):
+		return os.path.join(self.cache_dir, "objects", digest[:2], digest[2:])
+
+	def write_atomically(self, path, content):
+		if not os.path.isdir(os.path.dirname(path)):
+			try:
+				os.makedirs(os.path.dirname(path))
+			except OSError:
+				# another thread made it first
+				pass
+		temp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+		with open(temp_path, "wb") as temp_file:
+			temp_file.write(content)
+		os.rename(temp_path, path)
+
+	# function that returns (True, content) if the url is in the cache, where content is None if the page didn't exist,
+	# or (False, None) if the url hasn't been cached
+	def get(self, url):
+		try:
+			with open(self.url_path(url), "rb") as url_file:
+				digest = url_file.read()
+			if digest == self.MISSING:
+				return True, None
+			with open(self.object_path(digest), "rb") as object_file:
+				return True, object_file.read()
+		except IOError:
+			return False, None
+
+	# function that caches the content of a url (None means the page doesn't exist)
+	def put(self, url, content):
+		if content is None:
+			digest = self.MISSING
+		else:
+			digest = hashlib.sha1(content).hexdigest()
+			if not os.path.exists(self.object_path(digest)):
+				self.write_atomically(self.object_path(digest), content)
+		self.write_atomically(self.url_path(url), digest)
+
+
+# limits how often requests are made to each host
+# threads that want to make a request wait until at least min_interval seconds have passed since the last request to that host was allowed
+class RateLimiter(object):
+	def __init__(self, requests_per_second):
+		self.min_interval = 1.0 / requests_per_second
+		self.next_allowed = {}
+		self.lock = threading.Lock()
+
+	def wait(self, host):
+		with self.lock:
+			now = time.time()
+			allowed = max(now, self.next_allowed.get(host, now))
+			self.next_allowed[host] = allowed + self.min_interval
+		if allowed > now:
+			time.sleep(allowed - now)
+
+
+# fetches pages through the cache, rate limiting requests per host and retrying failed requests with exponential backoff
+# a page that doesn't exist (404) is cached as missing so that it isn't requested again on later runs
+class Fetcher(object):
+	def __init__(self, cache=None, rate_limiter=None, max_retries=4, backoff=1.0, timeout=30):
+		self.cache = cache
+		self.rate_limiter = rate_limiter
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.lock = threading.Lock()
+		self.requests = 0
+		self.cache_hits = 0
+
+	# function that returns the content of a url, or None if the page doesn't exist
+	# it raises a FetchError if the page still couldn't be fetched after retrying
+	def fetch(self, url):
+		if self.cache is not None:
+			cached, content = self.cache.get(url)
+			if cached:
+				with self.lock:
+					self.cache_hits += 1
+				instrumentation.increment("cache_hits_total")
+				return content
+		attempt = 0
+		while True:
+			if self.rate_limiter is not None:
+				self.rate_limiter.wait(urlparse.urlparse(url).netloc)
+			with self.lock:
+				self.requests += 1
+			start_time = time.time()
+			try:
+				response = urllib2.urlopen(url, timeout=self.timeout)
+				content = response.read()
+				instrumentation.observe("http_fetch_seconds", time.time() - start_time)
+				instrumentation.increment("http_requests_total", status=response.getcode())
+				break
+			except urllib2.HTTPError as e:
+				instrumentation.observe("http_fetch_seconds", time.time() - start_time)
+				instrumentation.increment("http_requests_total", status=e.code)
+				if e.code == 404:
+					content = None
+					break
+				# only server errors and being told to slow down are worth retrying
+				if (e.code < 500 and e.code != 429) or attempt >= self.max_retries:
+					raise FetchError("%s: %s" % (url, e))
+			# connections that are dropped or answered with garbage (e.g. BadStatusLine, IncompleteRead) raise an HTTPException that isn't a URLError
+			except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+				instrumentation.observe("http_fetch_seconds", time.time() - start_time)
+				instrumentation.increment("http_requests_total", status="error")
+				if attempt >= self.max_retries:
+					raise FetchError("%s: %s" % (url, e))
+			instrumentation.increment("http_retries_total")
+			# wait exponentially longer after each failure (with some jitter so the threads don't all retry at once)
+			time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+			attempt += 1
+		if self.cache is not None:
+			self.cache.put(url, content)
+		return content
+
+	def __call__(self, url):
+		return self.fetch(url)
+
+
+# checkpoint journal of the words that have already been scraped
+# each line is "word<tab>result" where the result is the repr of the word's etymology (or False if there wasn't one), so a restarted scrape
+# can skip every word that's in the journal and pick up exactly where it stopped
+class Journal(object):
+	def __init__(self, journal_file):
+		self.journal_file = journal_file
+		self.results = {}
+		self.lock = threading.Lock()
+		if os.path.exists(journal_file):
+			contents = open(journal_file).read()
+			# a line that was only partly written when the process stopped is ignored (and the word is scraped again),
+			# and cut off the file so the next line isn't appended onto it
+			complete = contents[:contents.rfind("\n") + 1]
+			if len(complete) < len(contents):
+				with open(journal_file, "r+") as journal:
+					journal.truncate(len(complete))
+			for line in complete.split("\n")[:-1]:
+				word, result = line.split("\t")
+				self.results[word] = ast.literal_eval(result)
+		self.output = open(journal_file, "a")
+
+	def __contains__(self, word):
+		return word in self.results
+
+	def record(self, word, result):
+		with self.lock:
+			self.results[word] = result
+			self.output.write("%s\t%r\n" % (word, result))
+			self.output.flush()
+
+	def close(self):
+		self.output.close()
+
+
+# function that scrapes a list of words with a pool of num_workers threads
+# scrape_word is called with each word that isn't already in the journal and its result is recorded in the journal as soon as it's done
+# (unless fetching one of its pages failed, in which case it's left out of the journal so it's retried on the next run)
+# returns the journal's results (for every word in the journal, including the ones from earlier runs)
+def run_scrape(words, scrape_word, journal, num_workers=8, progress_every=100):
+	remaining = [word for word in words if word not in journal]
+	print "%d words to scrape (%d already in the journal)" % (len(remaining), len(words) - len(remaining))
+	instrumentation.set_gauge("words_remaining", len(remaining))
+
+	def scrape_and_record(word):
+		try:
+			result = scrape_word(word)
+		except FetchError as e:
+			print "skipping %s until the next run because of an error: %s" % (word, e)
+			instrumentation.increment("words_scraped_total", outcome="deferred")
+			return word
+		except Exception as e:
+			# print e
+			instrumentation.increment("words_scraped_total", outcome="error")
+			result = False
+		else:
+			instrumentation.increment("words_scraped_total", outcome="found" if result else "no_etymology")
+		journal.record(word, result)
+		return word
+
+	pool = ThreadPool(num_workers)
+	try:
+		for counter, word in enumerate(pool.imap_unordered(scrape_and_record, remaining), 1):
+			instrumentation.set_gauge("words_remaining", len(remaining) - counter)
+			if counter % progress_every == 0:
+				print "--------------Scraped %d of %d words--------------" % (counter, len(remaining))
+	finally:
+		pool.close()
+		pool.join()
+	return journal.results
+
+
+# request handler for a local stand-in for etymonline, so the scraper can be run offline
+# it serves <fixture_dir>/<word>.html for /word/<word> and a 404 for everything else
+# to exercise the retries, the first failures requests for each path can be answered with a 503 instead
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	fixture_dir = "fixtures/etymonline"
+	failures = 0
+	# path -> number of requests for it so far
+	request_counts = {}
+	lock = threading.Lock()
+
+	def do_GET(self):
+		with self.lock:
+			self.request_counts[self.path] = self.request_counts.get(self.path, 0) + 1
+			failing = self.request_counts[self.path] <= self.failures
+		if failing:
+			self.send_error(503)
+			return
+		word = urllib2.unquote(self.path.rstrip("/").split("/")[-1])
+		path = os.path.join(self.fixture_dir, word + ".html")
+		if not self.path.startswith("/word/") or not os.path.isfile(path):
+			self.send_error(404)
+			return
+		content = open(path, "rb").read()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html; charset=utf-8")
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, format, *args):
+		pass
+
+
+# function that makes a server on localhost that serves the fixture pages in fixture_dir
+# port 0 picks a free port (the one used is server.server_address[1])
+# failures is the number of times each path fails (with a 503) before it's served
+def make_fixture_server(fixture_dir, port=0, failures=0):
+	class BoundFixtureHandler(FixtureHandler):
+		pass
+	BoundFixtureHandler.fixture_dir = fixture_dir
+	BoundFixtureHandler.failures = failures
+	BoundFixtureHandler.request_counts = {}
+	return BaseHTTPServer.HTTPServer(("127.0.0.1", port), BoundFixtureHandler)
+
+
+# this file can be called from the command line to serve the fixture pages:
+# python scrape_engine.py <fixture_dir> <port>
+# the scraper can then be pointed at it with --base-url http://127.0.0.1:<port>/word/%s
+if __name__ == "__main__":
+	server = make_fixture_server(sys.argv[1], int(sys.argv[2]))
+	print "Serving %s on http://127.0.0.1:%d/word/" % (sys.argv[1], server.server_address[1])
+	server.serve_forever()
@@ -1,55 +1,256 @@
 # coding=utf-8
 import sys
 import os
+import argparse
 import lxml.html
-import urllib2
+import lxml.etree
 import re
+import threading
+import itertools
 import nltk
 from nltk import word_tokenize, pos_tag
 from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.corpus import stopwords
+import scrape_engine
+import instrumentation
+from language_normalizer import take_language_phrase
 
 
-# function that takes an input word, gets the lemmatization of it, submits a url request to the appropriate etymology page,
-# and finds the languages contained within the response entries
+ETYMONLINE_URL = "https://www.etymonline.com/word/%s"
+
+
+# function that takes an input word, gets the lemmatization of it, and uses the resolver to find the languages contained within its etymology page
+# (and the pages of the roots it links to)
 # returns either an array of the langauge origin, or false if there is an error
-def get_etym(word, tested_link_words):	
+def get_etym(word, resolver):
 	try:
-		etym = []
 		lem, pos = get_lem(word)
-		url = "https://www.etymonline.com/word/%s" % lem
-		doc = lxml.html.parse(urllib2.urlopen(url))
-		# When the same word is used as multiple parts of speech, only one of the entries actually has the etymology information
-		# Derivative parts of speech refer to the main entry
-		# For example: call (n.) early 14c., "a loud cry, an outcry," also "a summons, an invitation," from call (v.).
-		# Because of this, we can just get the etymologies for all of the entries, and follow the links
-		entries = doc.xpath("//section[@class = 'word__defination--2q7ZH']/object/p[2]")
-		for entry in entries:
-			entry_text = lxml.etree.tostring(entry)
-			links = re.findall('<a href="\/word\/?\'?([^"\'>]*)', entry_text)
-			# Find the other words linked in the entries
-			# If any of them are roots (not prefixes or suffixes that include a "-" or single letters), get the etymology of them by recursively calling get_etym
-			for link_word in links:
-				if "-" not in link_word and len(link_word) > 1 and link_word not in tested_link_words:
-					tested_link_words.append(link_word)
-					etym = get_etym(link_word, tested_link_words)
-			curr_resp = parse_etym_paragraph(entry_text)
-			# just add the first entry
-			if len(etym) == 0:
-				etym += curr_resp
-			# for other entries check if we already have it
-			else:
-				curr_diff = []
-				for resp in curr_resp:
-					if resp not in etym:
-						curr_diff.append(resp)
-				etym += curr_diff
-		return etym
-	except:
-		# print "No etymology information for word %s (lem %s) \n" % (word, lem)
+		etym = resolver.resolve(lem)
+		if etym is None:
+			return False
+		return list(etym)
+	# pages that couldn't be fetched are passed on, so the word can be scraped again later
+	except scrape_engine.FetchError:
+		raise
+	except Exception as e:
+		# print "No etymology information for word %s \n" % word
+		instrumentation.increment("etymology_lookup_errors_total", error=type(e).__name__)
 		return False
 
 
+# function that parses an etymology page into its entries
+# When the same word is used as multiple parts of speech, only one of the entries actually has the etymology information
+# Derivative parts of speech refer to the main entry
+# For example: call (n.) early 14c., "a loud cry, an outcry," also "a summons, an invitation," from call (v.).
+# Because of this, we get the etymologies for all of the entries, along with the other words each entry links to
+# it returns a list with a tuple (linked_roots, languages) for each entry
+def parse_entries(html):
+	doc = lxml.html.fromstring(html)
+	entries = []
+	for entry in doc.xpath("//section[@class = 'word__defination--2q7ZH']/object/p[2]"):
+		link_words, entry_text = read_entry(entry)
+		linked_roots = []
+		# keep the linked words that are roots (not prefixes or suffixes that include a "-" or single letters)
+		# links can point to a specific entry on a page (e.g. /word/call#etymonline_v_28247) so drop that part
+		for link_word in link_words:
+			link_word = link_word.split("#")[0]
+			if "-" not in link_word and len(link_word) > 1 and link_word not in linked_roots:
+				linked_roots.append(link_word)
+		entries.append((linked_roots, parse_etym_text(remove_in_paren(entry_text))))
+	return entries
+
+
+# the part of a link's href after /word/ (the same pattern the links used to be found with in the serialized entry, so the same words are found)
+LINK_WORD = re.compile('\/word\/?\'?([^"\'>]*)')
+
+
+# function that escapes text the way lxml.etree.tostring does (the entries used to be parsed from their serialized html,
+# so keeping characters like "&" and "æ" as "&amp;" and "&#230;" gives exactly the same language phrases as before)
+def escape_text(text):
+	text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
+	if isinstance(text, unicode):
+		text = text.encode("ascii", "xmlcharrefreplace")
+	return text
+
+
+# function that escapes the value of an attribute the way lxml.etree.tostring does
+def escape_attribute(value):
+	return escape_text(value.replace('"', "&quot;").replace("\n", "&#10;").replace("\t", "&#9;"))
+
+
+# function that reads an entry in a single walk over its element tree (instead of serializing it and searching the html)
+# it returns the words the entry's links point to (the href of each <a> whose first attribute is an href to /word/, in order)
+# and the text of the entry with the tags dropped
+def read_entry(entry):
+	link_words = []
+	pieces = []
+	# (element, whether everything inside it has been read) for each element that hasn't been finished, so the tree is walked without recursing
+	# (lxml's iterwalk leaves out comments, but the text after a comment is still part of the entry)
+	unfinished = [(entry, False)]
+	while unfinished:
+		element, inside_read = unfinished.pop()
+		if inside_read:
+			# the tail of the entry itself is included as well, as it was in the serialized entry
+			if element.tail:
+				pieces.append(escape_text(element.tail))
+			continue
+		unfinished.append((element, True))
+		# comments and processing instructions have no text of their own in the entry, only their tails
+		if not isinstance(element.tag, basestring):
+			continue
+		if element.tag == "a" and element.attrib and element.attrib.keys()[0] == "href":
+			match = LINK_WORD.match(escape_attribute(element.get("href")))
+			if match:
+				link_words.append(match.group(1))
+		if element.text:
+			pieces.append(escape_text(element.text))
+		unfinished.extend((child, False) for child in reversed(element))
+	return link_words, "".join(pieces)
+
+
+# function that adds the languages that aren't already in etym to the end of it, keeping their order
+def merge_languages(etym, languages):
+	for lang in languages:
+		if lang not in etym:
+			etym.append(lang)
+
+
+# resolves the languages of words by following the links between etymology pages
+# the pages form a graph from each word to the roots its entries link to; every page is fetched and parsed only once,
+# and the languages of each word are memoized for the whole scrape, so shared roots (e.g. "call" or PIE stems) are only looked up once
+# a word's languages are merged entry by entry: first the languages of the roots the entry links to (in the order they're linked),
+# then the languages of the entry itself, skipping repeats
+# words that link to each other in a cycle are resolved together: the strongly connected components of the graph are found (with Tarjan's algorithm,
+# which finds a component only after every component it links to), and each word of a component is resolved by walking the component from it,
+# skipping the words the walk has already been through and taking the memoized languages of the roots outside the component
+# so every word comes out the same whatever order the words are resolved in, and however the worker threads sharing the resolver interleave,
+# and resolving a word costs at most one walk of its component rather than one walk for every path through it
+class EtymResolver(object):
+	def __init__(self, fetch, base_url=ETYMONLINE_URL):
+		# fetch is called with a url and returns the page's html, or None if there is no page (e.g. a scrape_engine.Fetcher)
+		self.fetch = fetch
+		self.base_url = base_url
+		# word -> parsed entries of the word's page, or None if there is no page
+		self.pages = {}
+		# word -> event that's set when a thread fetching the word's page is done, so no page is fetched twice at the same time
+		self.pending_pages = {}
+		self.lock = threading.Lock()
+		# word -> the word's exception if fetching or parsing its page failed in the thread that fetched it, so the threads that waited for it get it too
+		self.page_errors = {}
+		# word -> resolved languages, or None if there is no page
+		self.resolved = {}
+
+	# function that returns the parsed entries of a word's page (fetching it if this is the first time it's needed)
+	def get_page(self, word):
+		with self.lock:
+			if word in self.pages:
+				return self.pages[word]
+			pending = self.pending_pages.get(word)
+			if pending is None:
+				self.pending_pages[word] = threading.Event()
+		if pending is not None:
+			pending.wait()
+			if word not in self.pages:
+				raise self.page_errors.get(word) or scrape_engine.FetchError("fetching %s failed in another thread" % word)
+			return self.pages[word]
+		try:
+			html = self.fetch(self.base_url % word)
+			if html is None:
+				self.pages[word] = None
+			else:
+				self.pages[word] = parse_entries(html)
+			return self.pages[word]
+		except Exception as e:
+			with self.lock:
+				self.page_errors[word] = e
+			raise
+		finally:
+			with self.lock:
+				self.pending_pages.pop(word).set()
+
+	# function that returns the roots a word's page links to, in the order they're linked (fetching the page if this is the first time it's needed)
+	def links(self, word):
+		page = self.get_page(word)
+		if page is None:
+			return []
+		return [root for roots, languages in page for root in roots]
+
+	# function that returns the merged languages of a word and all of the roots it links to, or None if the word has no page
+	# the components of the words reachable from the word that haven't been resolved yet are found with an iterative Tarjan's algorithm,
+	# and each one is resolved as soon as it's found
+	def resolve(self, word):
+		if word in self.resolved:
+			return self.resolved[word]
+		index = {word: 0}
+		lowlink = {word: 0}
+		stack = [word]
+		on_stack = set([word])
+		work = [(word, iter(self.links(word)))]
+		while work:
+			node, links = work[-1]
+			for root in links:
+				# roots that are already resolved are in components that were found before
+				if root in self.resolved:
+					continue
+				if root not in index:
+					index[root] = lowlink[root] = len(index)
+					stack.append(root)
+					on_stack.add(root)
+					work.append((root, iter(self.links(root))))
+					break
+				if root in on_stack:
+					lowlink[node] = min(lowlink[node], index[root])
+			else:
+				work.pop()
+				if work:
+					parent = work[-1][0]
+					lowlink[parent] = min(lowlink[parent], lowlink[node])
+				if lowlink[node] == index[node]:
+					component = set()
+					while True:
+						member = stack.pop()
+						on_stack.discard(member)
+						component.add(member)
+						if member == node:
+							break
+					for member in sorted(component):
+						self.resolved[member] = self.resolve_in_component(member, component)
+		return self.resolved[word]
+
+	# function that resolves a word of a component, whose roots outside the component have all been resolved already
+	# the component is walked depth first from the word (with an explicit stack), skipping the words it has already been through
+	def resolve_in_component(self, word, component):
+		if self.pages[word] is None:
+			return None
+		visited = set([word])
+		walk = [(word, [], iter_entry_steps(self.pages[word]))]
+		while True:
+			node, etym, steps = walk[-1]
+			for root, languages in steps:
+				if root is None:
+					merge_languages(etym, languages)
+				elif root not in component:
+					if self.resolved[root] is not None:
+						merge_languages(etym, self.resolved[root])
+				elif root not in visited:
+					visited.add(root)
+					walk.append((root, [], iter_entry_steps(self.pages[root])))
+					break
+			else:
+				walk.pop()
+				if not walk:
+					return etym
+				merge_languages(walk[-1][1], etym)
+
+
+# function that yields the steps of merging a page's languages, entry by entry: (root, None) for each root the entry links to, then (None, languages)
+def iter_entry_steps(page):
+	for roots, languages in page:
+		for root in roots:
+			yield root, None
+		yield None, languages
+
+
 # function that parses the etymology entry on a given page to find the origin languages contained within
 # it returns an array of the origin languages contained within an entry
 # because the entries list origin languages from most to least recent, the relative order is maintained such that
@@ -60,23 +261,25 @@ def parse_etym_paragraph(paragraph):
 	paragraph = remove_in_paren(paragraph)
 	# remove the html syntax from the paragraph
 	cleaned_paragraph = re.sub(re.compile('<.*?>'), "", paragraph)
+	return parse_etym_text(cleaned_paragraph)
+
+
+# function that finds the origin languages in the text of an entry (with the html and the text within parentheses already removed)
+def parse_etym_text(text):
 	etymologies = []
 	# split the entry up into branches delineated by "from" statements
-	for branch in cleaned_paragraph.split("from "):
+	for branch in text.split("from "):
+		# the first token of a branch starts with its first character, so a branch that doesn't start with a capital letter
+		# can't start with a language and doesn't need to be tokenized
+		stripped_branch = branch.lstrip()
+		if stripped_branch and not stripped_branch[0].isupper():
+			continue
 		curr_branch = word_tokenize(branch)
-		# the language will be the first phrase (after "from " or the first phrase overall)
-		curr_etym = curr_branch[0]
-		# only look at the words in the entry (if there is a date included, which happens sometimes for the first word of the entry, skip it)
-		# and utilize the fact that languages referenced in the entries have capital letters (inluding any modifiers, e.g. "Old Norse") by using str.istitle
-		if any(char.isdigit() for char in curr_etym) or curr_etym[0].isupper() == False:
+		# the language will be the first phrase (after "from " or the first phrase overall), made of the first word and the capitalized words after it
+		# (if there is a date included, which happens sometimes for the first word of the entry, or the branch doesn't start with a capital letter, skip it)
+		curr_etym = take_language_phrase(curr_branch)
+		if curr_etym is None:
 			continue
-		# go through the next words in the branch and add them to curr_etym until we don't have a language name anymore
-		# things can get wonky when other characters like "ænlic" are included so also check that the first character is a letter
-		for i in range(1,len(curr_branch)):
-			if (curr_etym + " " + curr_branch[i]).istitle() and curr_branch[i].isalpha():
-				curr_etym += " " + curr_branch[i]
-			else:
-				break
 		# by appended the languages, the relative order is retained
 		etymologies.append(curr_etym)
 	return etymologies
@@ -97,76 +300,96 @@ def get_lem(word):
 # function to remove text within parentheses
 # this is necessary because entries often contain sentences in parentheses saying "source also of..." that list related words in other languges
 # when looking for a word's languages of origin though, we don't want this data
+# the parentheses are matched the same way as removing the text between the last open parenthesis and the first closed one after it,
+# over and over until there are none left, but in a single pass from right to left: each open parenthesis is matched with the nearest
+# closed parenthesis to its right that hasn't been matched yet, and the scan stops (keeping everything before it) at an open parenthesis
+# that has nothing left to match, just as the repeated removal would
 def remove_in_paren(paragraph):
-	# assume that each open parenthesis has a matching closed one
-	num_to_remove = paragraph.count('(')
-	removed_all = False
-	removed = 0
-	while removed < num_to_remove:
-		# find the last open parenthesis
-		open_paren = paragraph.rfind('(')
-		# find the first closed parenthesis from that index on
-		closed_paren_diff = paragraph[open_paren:].find(')')
-		if open_paren == -1 or closed_paren_diff == -1:
-			break
-		else:
-			# update the paragraph to remove the text between the matching open and closed parens
-			# the index of the closed parenthesis can be found by adding the closed_paren_diff to the open_paren index
-			paragraph = paragraph[0:open_paren] + paragraph[(open_paren + closed_paren_diff + 1):]
-			removed += 1
-	return paragraph
-
+	unmatched_closes = []
+	# the (start, end) of each removed span that isn't inside another one, from right to left
+	removed_spans = []
+	for i in xrange(len(paragraph) - 1, -1, -1):
+		char = paragraph[i]
+		if char == ')':
+			unmatched_closes.append(i)
+		elif char == '(':
+			if not unmatched_closes:
+				break
+			end = unmatched_closes.pop()
+			# the spans already removed between the parentheses are part of this one
+			while removed_spans and removed_spans[-1][0] < end:
+				removed_spans.pop()
+			removed_spans.append((i, end))
+	if not removed_spans:
+		return paragraph
+	pieces = []
+	kept_from = 0
+	for start, end in reversed(removed_spans):
+		pieces.append(paragraph[kept_from:start])
+		kept_from = end + 1
+	pieces.append(paragraph[kept_from:])
+	return "".join(pieces)
 
 
 # the main function
 # this file should be called from the command line as follows:
-# python scrape_etymologies.py <output_filename>
+# python scrape_etymologies.py <output_filename> [--workers N] [--rate R] [--cache-dir DIR] [--journal FILE] [--base-url URL] [--metrics-file F] [--metrics-port P]
 # the file assumes that the data to get the etymologies for is in a folder called "rotten_imdb" in the current directory
 # when run, the program goes through all of the words in the subjective and objective data files and finds the origin languages for them
+# the pages are fetched by a pool of worker threads (rate limited per host) through an on-disk cache, and every scraped word is checkpointed in a journal,
+# so if the scrape stops it can just be run again and it continues from where it was
 # the results are stored in an output file for quicker access later
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("output_filename")
+	parser.add_argument("--workers", type=int, default=8, help="number of pages fetched at the same time")
+	parser.add_argument("--rate", type=float, default=4.0, help="maximum requests per second to each host")
+	parser.add_argument("--cache-dir", default="etymonline_cache", help="directory the fetched pages are cached in")
+	parser.add_argument("--journal", default=None, help="checkpoint journal (defaults to <output_filename>.journal)")
+	parser.add_argument("--base-url", default=ETYMONLINE_URL, help="url of an entry, with %%s in place of the word")
+	parser.add_argument("--metrics-file", default=None, help="keep the run's metrics (in the Prometheus text format) up to date in this file")
+	parser.add_argument("--metrics-port", type=int, default=None, help="serve the run's metrics on http://127.0.0.1:<port>/metrics")
+	args = parser.parse_args()
+	instrumentation.start(args.metrics_file, args.metrics_port)
+
 	lemmatizer = WordNetLemmatizer()
 	# the following line may need to be run the first time
 	# nltk.download('wordnet')
+	# wordnet is loaded lazily, so load it before the worker threads start
+	get_lem("test")
 	# pass this function the full path to the data (which should be a text file)
 	subjective_file = os.getcwd() + "/rotten_imdb/quote.tok.gt9.5000"
-	subjective_content = open(subjective_file).readlines()
 	objective_file = os.getcwd() + "/rotten_imdb/plot.tok.gt9.5000"
-	objective_content = open(objective_file).readlines()
-	# run all of the data and save the etymologies in a file so that looking up the etymologies later is faster
-	outfile = sys.argv[1]
-	output = open(outfile, 'w')
-	header = 'word\t[etymology]\n'
-	output.write(header)
-	# all_content = objective_content + subjective_content
-	all_content = subjective_content
-	# create a dictionary of words that we already scraped
-	# this was necessary because approximately half of the total lines were saved before a crash
-	prev_words = {}
-	prev_scrap = open("scraped_etymologies_0.txt").readlines()
-	prev_scrap = prev_scrap[1:]
-	for line in prev_scrap:
-		line = line.rstrip()
-		prev_word = line.split('\t')[0]
-		prev_words[prev_word] = 1
-	words = {}
-	counter = 0
-	for line in all_content:
+	# find all of the distinct words in the data (in the order they first appear)
+	# the files are read a line at a time, so only the vocabulary is kept in memory however big they are
+	words = []
+	seen_words = {}
+	for line in itertools.chain(open(objective_file), open(subjective_file)):
 		try:
-			print "\n" + line
 			for word in word_tokenize(line):
-				if word not in words and word not in prev_words:
-					words[word] = 1
-					pos = pos_tag(word_tokenize(word))[0][1]
-					word_etym = get_etym(word, [])
-					if word_etym:
-						print word + " - " + str(word_etym)
-						outline = '{0}\t{1}\n'.format(word, str(word_etym))
-						output.write(outline)
-		except:
+				if word not in seen_words:
+					seen_words[word] = 1
+					words.append(word)
+		except Exception as e:
 			print "skipping a line because of an error"
-		counter += 1
-		if counter % 100 == 0:
-			print "\n \n \n--------------Checking line number %d-------------- \n \n \n" % counter
+			instrumentation.increment("lines_skipped_total", stage="tokenize")
 
+	fetcher = scrape_engine.Fetcher(scrape_engine.HttpCache(args.cache_dir), scrape_engine.RateLimiter(args.rate))
+	# one resolver is shared by all of the words, so each root is only fetched and resolved once
+	resolver = EtymResolver(fetcher, args.base_url)
+	journal = scrape_engine.Journal(args.journal or args.output_filename + ".journal")
+	results = scrape_engine.run_scrape(words, lambda word: get_etym(word, resolver), journal, args.workers)
+	journal.close()
+	print "%d pages requested, %d served from the cache, %d words resolved" % (fetcher.requests, fetcher.cache_hits, len(resolver.resolved))
 
+	# run all of the data and save the etymologies in a file so that looking up the etymologies later is faster
+	output = open(args.output_filename, 'w')
+	header = 'word\t[etymology]\n'
+	output.write(header)
+	for word in words:
+		word_etym = results.get(word)
+		if word_etym:
+			outline = '{0}\t{1}\n'.format(word, str(word_etym))
+			output.write(outline)
+	output.close()
+	instrumentation.stop()
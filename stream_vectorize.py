@@ -0,0 +1,220 @@
+# coding=utf-8
+import sys
+import os
+import argparse
+import collections
+import glob
+import json
+import multiprocessing
+import numpy as np
+from scipy import sparse
+import etym_classifier_utils as utils
+
+
+# the directory a corpus is vectorized into holds numbered shards, each an .npz file with the parts of a CSR matrix (data, indices, indptr, shape)
+# for one chunk of the input along with the numbers of the input lines its rows came from (lines that couldn't be tokenized have no row),
+# and a manifest (written last, so a directory without one is an unfinished run) describing the shards and how they were made
+MANIFEST_FORMAT = "etymological-feature-shards"
+MANIFEST_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+# the settings and tables used to vectorize a chunk
+# they're set before the worker processes are made, so the workers inherit them instead of having them pickled with every chunk
+stream_language_table = None
+stream_ordered_languages = None
+stream_stop_words = None
+stream_settings = None
+# the token table of the word lemmatization path, which grows with the vocabulary seen by the process (not with the size of the input)
+stream_token_table = {}
+
+
+# function that lazily yields the lines of each of the input files in turn, so only the line being read is ever in memory
+def iter_lines(input_files):
+	for input_file in input_files:
+		with open(input_file) as input_lines:
+			for line in input_lines:
+				yield line
+
+
+# function that groups lines into lists of chunk_size lines, yielding (number of the first line, lines) for each
+def iter_chunks(lines, chunk_size):
+	chunk = []
+	first_line = 0
+	for line in lines:
+		chunk.append(line)
+		if len(chunk) == chunk_size:
+			yield first_line, chunk
+			first_line += len(chunk)
+			chunk = []
+	if chunk:
+		yield first_line, chunk
+
+
+# function that vectorizes one chunk of lines with the stream settings
+# returns the chunk's feature matrix and the numbers of the lines its rows came from
+def vectorize_chunk(first_line, lines):
+	tokenized_content = utils.tokenize_content(lines)
+	if stream_settings["lemmatize"] == "sentence":
+		lemmatized_content = utils.lemmatize_content(tokenized_content)
+		token_table = stream_language_table
+	else:
+		lemmatized_content = None
+		new_tokens = [[word for word in tokens if word not in stream_token_table] for tokens in tokenized_content if tokens is not None]
+		stream_token_table.update(utils.compile_token_table(new_tokens, stream_language_table))
+		token_table = stream_token_table
+	matrices = utils.get_feature_matrices(tokenized_content, token_table, stream_ordered_languages, stream_stop_words, lemmatized_content)
+	matrix_first, matrix_all = matrices[(stream_settings["include_stopwords"], stream_settings["freq_or_count"])]
+	matrix = matrix_first if stream_settings["first_or_all"] == "first language" else matrix_all
+	line_numbers = np.array([first_line + i for i, tokens in enumerate(tokenized_content) if tokens is not None], dtype=np.int64)
+	return matrix, line_numbers
+
+
+# function that writes a shard (a matrix and the line numbers of its rows) to an .npz file
+# it's written to a temporary file and renamed into place, so a shard file is always complete
+def write_shard(shard_file, matrix, line_numbers, compress=False):
+	temp_file = shard_file + ".tmp"
+	save = np.savez_compressed if compress else np.savez
+	with open(temp_file, "wb") as output:
+		save(output, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=np.array(matrix.shape), line_numbers=line_numbers)
+	os.rename(temp_file, shard_file)
+
+
+# function that reads a shard written by write_shard, returning (matrix, line numbers)
+def read_shard(shard_file):
+	shard = np.load(shard_file)
+	matrix = sparse.csr_matrix((shard["data"], shard["indices"], shard["indptr"]), shape=tuple(shard["shape"]))
+	return matrix, shard["line_numbers"]
+
+
+# function that vectorizes a chunk and writes it straight to its shard file, so the matrix never has to be sent back to the parent process
+# returns (shard file name, number of rows, number of lines, number of nonzero values) for the manifest
+def process_chunk(task):
+	output_dir, shard_index, first_line, lines = task
+	matrix, line_numbers = vectorize_chunk(first_line, lines)
+	shard_name = "shard-%06d.npz" % shard_index
+	write_shard(os.path.join(output_dir, shard_name), matrix, line_numbers, stream_settings["compress"])
+	return shard_name, matrix.shape[0], len(lines), matrix.nnz
+
+
+# function that vectorizes the lines of a corpus (any iterable of lines, like iter_lines) chunk by chunk into shards in output_dir
+# only a bounded number of chunks is in memory at a time (one, or two per worker with num_processes > 1), so the peak memory use depends on
+# chunk_size and not on the size of the corpus
+# the settings pick which variation of the vectors is written (as in experiment.py), and lemmatize is "word" or "sentence" (see get_lem and lemmatize_content)
+# returns the manifest, which is also written to output_dir
+def vectorize_stream(lines, output_dir, language_table, ordered_languages, stop_words, include_stopwords=True, freq_or_count="count",
+		first_or_all="all languages", lemmatize="word", chunk_size=10000, num_processes=1, compress=False, input_files=None):
+	global stream_language_table, stream_ordered_languages, stream_stop_words, stream_settings
+	stream_language_table = language_table
+	stream_ordered_languages = ordered_languages
+	stream_stop_words = stop_words
+	stream_settings = {
+		"include_stopwords": include_stopwords,
+		"freq_or_count": freq_or_count,
+		"first_or_all": first_or_all,
+		"lemmatize": lemmatize,
+		"compress": compress,
+	}
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	if os.path.exists(os.path.join(output_dir, MANIFEST_FILE)):
+		os.remove(os.path.join(output_dir, MANIFEST_FILE))
+	# the shards of an earlier run into the same directory are removed (after its manifest, so they're never listed without their files),
+	# since a shorter input would leave its extra shards behind
+	for shard_file in glob.glob(os.path.join(output_dir, "shard-*.npz")) + glob.glob(os.path.join(output_dir, "shard-*.npz.tmp")):
+		os.remove(shard_file)
+	tasks = ((output_dir, shard_index, first_line, chunk) for shard_index, (first_line, chunk) in enumerate(iter_chunks(lines, chunk_size)))
+	shards = []
+	if num_processes == 1:
+		for task in tasks:
+			shards.append(process_chunk(task))
+	else:
+		# pool.imap would read the whole input into its task queue as fast as it can, so instead only a few chunks per worker are handed out at a time
+		# and the next chunk is only read once the oldest one is done (the shards are still recorded in order)
+		pool = multiprocessing.Pool(num_processes)
+		try:
+			pending = collections.deque()
+			for task in tasks:
+				if len(pending) >= 2 * num_processes:
+					shards.append(pending.popleft().get())
+				pending.append(pool.apply_async(process_chunk, (task,)))
+			while pending:
+				shards.append(pending.popleft().get())
+		finally:
+			pool.close()
+			pool.join()
+	manifest = {
+		"format": MANIFEST_FORMAT,
+		"version": MANIFEST_VERSION,
+		"input_files": input_files or [],
+		"ordered_languages": list(ordered_languages),
+		"settings": dict((key, value) for key, value in stream_settings.items() if key != "compress"),
+		"num_rows": sum(shard[1] for shard in shards),
+		"num_lines": sum(shard[2] for shard in shards),
+		"nnz": sum(shard[3] for shard in shards),
+		"shards": [{"file": shard[0], "rows": shard[1], "lines": shard[2]} for shard in shards],
+	}
+	temp_file = os.path.join(output_dir, MANIFEST_FILE + ".tmp")
+	with open(temp_file, "w") as output:
+		json.dump(manifest, output, indent=1)
+	os.rename(temp_file, os.path.join(output_dir, MANIFEST_FILE))
+	return manifest
+
+
+# function that reads the manifest of a directory of shards
+def read_manifest(output_dir):
+	manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+	if not os.path.exists(manifest_file):
+		raise ValueError("%s has no manifest (it isn't a directory of shards, or vectorizing it didn't finish)" % output_dir)
+	manifest = json.load(open(manifest_file))
+	if manifest.get("format") != MANIFEST_FORMAT or manifest.get("version") != MANIFEST_VERSION:
+		raise ValueError("%s has an unsupported manifest" % output_dir)
+	return manifest
+
+
+# function that yields the (matrix, line numbers) of each shard in a directory in order, one shard in memory at a time
+def iter_shards(output_dir):
+	for shard in read_manifest(output_dir)["shards"]:
+		yield read_shard(os.path.join(output_dir, shard["file"]))
+
+
+# function that stacks every shard in a directory into one CSR matrix (for corpora whose vectors fit in memory), returning (matrix, line numbers)
+def load_feature_matrix(output_dir):
+	manifest = read_manifest(output_dir)
+	matrices = []
+	line_numbers = []
+	for matrix, shard_line_numbers in iter_shards(output_dir):
+		matrices.append(matrix)
+		line_numbers.append(shard_line_numbers)
+	if not matrices:
+		return sparse.csr_matrix((0, len(manifest["ordered_languages"]))), np.zeros(0, dtype=np.int64)
+	return sparse.vstack(matrices, format="csr"), np.concatenate(line_numbers)
+
+
+# this file should be called from the command line as follows:
+# python stream_vectorize.py <output_dir> <input_file> [<input_file> ...] [--chunk-size N] [--processes N] [--lemmatize word|sentence]
+#   [--freq-or-count count|frequency] [--first-language] [--no-stopwords] [--compress]
+# it vectorizes the lines of the input files (which can be far bigger than memory) into shards in output_dir, which can be read back with iter_shards or load_feature_matrix
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("output_dir")
+	parser.add_argument("input_files", nargs="+")
+	parser.add_argument("--chunk-size", type=int, default=10000, help="number of lines vectorized together and written to each shard")
+	parser.add_argument("--processes", type=int, default=1, help="number of processes to vectorize chunks on")
+	parser.add_argument("--lemmatize", default="word", choices=["word", "sentence"])
+	parser.add_argument("--freq-or-count", default="count", choices=["count", "frequency"])
+	parser.add_argument("--first-language", action="store_true", help="only use the first (most recent) language of each word")
+	parser.add_argument("--no-stopwords", action="store_true", help="leave stopwords out of the vectors")
+	parser.add_argument("--compress", action="store_true", help="compress the shards")
+	args = parser.parse_args()
+
+	from nltk.corpus import stopwords
+	import etym_store
+	import language_registry
+	etym_dict = etym_store.load_etym_dict("scraped_etymologies.txt")
+	list_of_languages = utils.read_list_of_languages(os.getcwd() + "/list_of_languages.txt")
+	ordered_languages = language_registry.load_ordered_languages(etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages)
+	language_table = utils.compile_language_table(etym_dict, ordered_languages, utils.ACCEPTABLE_MODIFIERS, list_of_languages)
+	first_or_all = "first language" if args.first_language else "all languages"
+	manifest = vectorize_stream(iter_lines(args.input_files), args.output_dir, language_table, ordered_languages, set(stopwords.words('english')),
+		not args.no_stopwords, args.freq_or_count, first_or_all, args.lemmatize, args.chunk_size, args.processes, args.compress, args.input_files)
+	print "Vectorized %d lines into %d rows in %d shards in %s" % (manifest["num_lines"], manifest["num_rows"], len(manifest["shards"]), args.output_dir)
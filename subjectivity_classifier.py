@@ -0,0 +1,209 @@
+# coding=utf-8
+import sys
+import os
+import argparse
+import cPickle as pickle
+import numpy as np
+from scipy import sparse
+import etym_classifier_utils as utils
+
+
+# the artifact a SubjectivityClassifier is saved to is a pickled dictionary tagged with this format name and version
+# the version is bumped whenever what's saved changes, so an old artifact fails to load with a clear error instead of misbehaving
+ARTIFACT_FORMAT = "etymological-subjectivity-classifier"
+ARTIFACT_VERSION = 2
+
+LABELS = ["objective", "subjective"]
+
+
+# a trained subjectivity classifier that can be saved, loaded, and used to classify new sentences
+# it bundles the fitted model with everything needed to vectorize a sentence the same way as the training data: the ordered languages,
+# the acceptable modifiers and list of languages, the compiled language and token tables, and the vectorization settings
+# the token table only holds the words of the training data, so for most sentences classifying is just tokenizing, gathering from the table,
+# and running the model; other words are lemmatized each time they're classified, and never added to the table
+# sentences are lemmatized the same way as the training data: each word on its own ("word"), or every word in the context of its sentence
+# ("sentence", which tags the sentences being classified in one pass and looks their lemmas up in the language table, so the token table isn't used)
+class SubjectivityClassifier(object):
+	def __init__(self, model, ordered_languages, acceptable_modifiers, list_of_languages, language_table, token_table, stop_words,
+			include_stopwords=True, freq_or_count="count", first_or_all="all languages", backend="svm", lemmatize="word"):
+		self.model = model
+		self.ordered_languages = list(ordered_languages)
+		self.acceptable_modifiers = list(acceptable_modifiers)
+		self.list_of_languages = list(list_of_languages)
+		self.language_table = language_table
+		self.token_table = token_table
+		self.stop_words = set(stop_words)
+		self.include_stopwords = include_stopwords
+		self.freq_or_count = freq_or_count
+		self.first_or_all = first_or_all
+		self.backend = backend
+		self.lemmatize = lemmatize
+
+	# function that trains a classifier on lists of subjective and objective sentences
+	# the etymology dictionary can be a dictionary from build_etym_dict or an etym_store.EtymStore
+	# the columns are the given ordered languages (e.g. from a language_registry.LanguageRegistry), or the languages of the dictionary sorted by name
+	@classmethod
+	def train(cls, subjective_content, objective_content, etym_dict, acceptable_modifiers, list_of_languages, stop_words,
+			include_stopwords=True, freq_or_count="count", first_or_all="all languages", backend="svm", ordered_languages=None, lemmatize="word"):
+		if ordered_languages is None:
+			ordered_languages = utils.get_ordered_languages(etym_dict, acceptable_modifiers, list_of_languages)
+		language_table = utils.compile_language_table(etym_dict, ordered_languages, acceptable_modifiers, list_of_languages)
+		subjective_tokens = utils.tokenize_content(subjective_content)
+		objective_tokens = utils.tokenize_content(objective_content)
+		if lemmatize == "sentence":
+			token_table = {}
+			subjective_matrices = utils.get_feature_matrices(subjective_tokens, language_table, ordered_languages, stop_words, utils.lemmatize_content(subjective_tokens))
+			objective_matrices = utils.get_feature_matrices(objective_tokens, language_table, ordered_languages, stop_words, utils.lemmatize_content(objective_tokens))
+		else:
+			token_table = utils.compile_token_table(subjective_tokens + objective_tokens, language_table)
+			subjective_matrices = utils.get_feature_matrices(subjective_tokens, token_table, ordered_languages, stop_words)
+			objective_matrices = utils.get_feature_matrices(objective_tokens, token_table, ordered_languages, stop_words)
+		# the matrices are (first language, all languages)
+		which = 0 if first_or_all == "first language" else 1
+		subjective_data = subjective_matrices[(include_stopwords, freq_or_count)][which]
+		objective_data = objective_matrices[(include_stopwords, freq_or_count)][which]
+		data = sparse.vstack((subjective_data, objective_data), format="csr")
+		labels = np.concatenate((np.ones(subjective_data.shape[0], dtype=int), np.zeros(objective_data.shape[0], dtype=int)))
+		model = utils.build_classifier(backend, len(ordered_languages))
+		# a kernel svm fitted on a sparse matrix converts every vector it's asked to predict to a sparse matrix, which costs more than the prediction itself
+		# for a single sentence, so it's fitted on the dense vectors instead (the other backends take either)
+		if backend == "svm":
+			data = data.toarray()
+		model.fit(data, labels)
+		return cls(model, ordered_languages, acceptable_modifiers, list_of_languages, language_table, token_table, stop_words,
+			include_stopwords, freq_or_count, first_or_all, backend, lemmatize)
+
+	# function that saves the classifier to a single artifact file
+	def save(self, model_file):
+		artifact = {
+			"format": ARTIFACT_FORMAT,
+			"version": ARTIFACT_VERSION,
+			"model": self.model,
+			"ordered_languages": self.ordered_languages,
+			"acceptable_modifiers": self.acceptable_modifiers,
+			"list_of_languages": self.list_of_languages,
+			"language_table": self.language_table,
+			"token_table": self.token_table,
+			"stop_words": self.stop_words,
+			"include_stopwords": self.include_stopwords,
+			"freq_or_count": self.freq_or_count,
+			"first_or_all": self.first_or_all,
+			"backend": self.backend,
+			"lemmatize": self.lemmatize,
+		}
+		# write to a temporary file first so that a crash never leaves a broken artifact in place of a working one
+		temp_file = model_file + ".tmp"
+		with open(temp_file, "wb") as output:
+			pickle.dump(artifact, output, pickle.HIGHEST_PROTOCOL)
+		os.rename(temp_file, model_file)
+
+	# function that loads a classifier from an artifact file made by save
+	@classmethod
+	def load(cls, model_file):
+		with open(model_file, "rb") as model_input:
+			artifact = pickle.load(model_input)
+		if not isinstance(artifact, dict) or artifact.get("format") != ARTIFACT_FORMAT:
+			raise ValueError("%s is not a subjectivity classifier artifact" % model_file)
+		if artifact["version"] != ARTIFACT_VERSION:
+			raise ValueError("%s has artifact version %s, expected %d" % (model_file, artifact["version"], ARTIFACT_VERSION))
+		return cls(artifact["model"], artifact["ordered_languages"], artifact["acceptable_modifiers"], artifact["list_of_languages"],
+			artifact["language_table"], artifact["token_table"], artifact["stop_words"], artifact["include_stopwords"],
+			artifact["freq_or_count"], artifact["first_or_all"], artifact["backend"], artifact["lemmatize"])
+
+	# function that folds new or rescraped etymology entries (a dictionary of word -> languages) into the classifier without retraining it
+	# the model's columns don't change: languages the classifier doesn't have a column for are handled the same way as when compiling the language table
+	# the token table is compiled again for the same words, since any of them could lemmatize to one of the new words
+	def update_etymologies(self, new_entries):
+		self.language_table.update(utils.compile_language_table(new_entries, self.ordered_languages, self.acceptable_modifiers, self.list_of_languages))
+		self.token_table = utils.compile_token_table([list(self.token_table)], self.language_table)
+
+	# function that returns the token table entries of the words of the tokenized sentences
+	# words that aren't in the token table are looked up for this call only, so classifying arbitrary text never grows the classifier
+	def lookup_tokens(self, tokenized_content):
+		table = {}
+		unseen = []
+		for tokens in tokenized_content:
+			if tokens is None:
+				continue
+			for word in tokens:
+				if word in self.token_table:
+					table[word] = self.token_table[word]
+				else:
+					unseen.append(word)
+		table.update(utils.compile_token_table([unseen], self.language_table))
+		return table
+
+	# function that returns a matrix with the vector of each sentence (a sentence that can't be tokenized gets a vector of zeros)
+	def transform(self, sentences):
+		tokenized_content = utils.tokenize_content(sentences)
+		if self.lemmatize == "sentence":
+			token_table = self.language_table
+			lemmatized_content = utils.lemmatize_content(tokenized_content)
+		else:
+			token_table = self.lookup_tokens(tokenized_content)
+			lemmatized_content = None
+		vectors = np.zeros((len(sentences), len(self.ordered_languages)))
+		for i, tokens in enumerate(tokenized_content):
+			if tokens is None:
+				continue
+			lemmas = lemmatized_content[i] if lemmatized_content is not None else None
+			vector_first, vector_all = utils.vectorize(tokens, token_table, self.ordered_languages, self.include_stopwords, self.stop_words, self.freq_or_count, lemmas)
+			if self.first_or_all == "first language":
+				vectors[i] = vector_first
+			else:
+				vectors[i] = vector_all
+		return vectors
+
+	# function that classifies a list of sentences, returning "subjective" or "objective" for each
+	def predict_batch(self, sentences):
+		if len(sentences) == 0:
+			return []
+		predictions = self.model.predict(self.transform(sentences))
+		return [LABELS[prediction] for prediction in predictions]
+
+	# function that classifies one sentence, returning "subjective" or "objective"
+	def predict(self, sentence):
+		return self.predict_batch([sentence])[0]
+
+
+# this file can be called from the command line to train a classifier and save it:
+# python subjectivity_classifier.py train <model_file> [--backend B] [--freq-or-count count|frequency] [--first-language] [--no-stopwords] [--lemmatize word|sentence]
+# or to classify sentences (one per line) from a file, or from standard input if no file is given:
+# python subjectivity_classifier.py predict <model_file> [<sentences_file>]
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers(dest="command")
+	train_parser = subparsers.add_parser("train")
+	train_parser.add_argument("model_file")
+	train_parser.add_argument("--backend", default="svm", choices=utils.CLASSIFIER_BACKENDS)
+	train_parser.add_argument("--freq-or-count", default="count", choices=["count", "frequency"])
+	train_parser.add_argument("--first-language", action="store_true", help="only use the first (most recent) language of each word")
+	train_parser.add_argument("--no-stopwords", action="store_true", help="leave stopwords out of the vectors")
+	train_parser.add_argument("--lemmatize", default="word", choices=["word", "sentence"], help="tag each word on its own, or words in the context of their sentence")
+	predict_parser = subparsers.add_parser("predict")
+	predict_parser.add_argument("model_file")
+	predict_parser.add_argument("sentences_file", nargs="?")
+	args = parser.parse_args()
+
+	if args.command == "train":
+		from nltk.corpus import stopwords
+		import etym_store
+		import language_registry
+		subjective_content = open(os.getcwd() + "/rotten_imdb/quote.tok.gt9.5000").readlines()
+		objective_content = open(os.getcwd() + "/rotten_imdb/plot.tok.gt9.5000").readlines()
+		etym_dict = etym_store.load_etym_dict("scraped_etymologies.txt")
+		list_of_languages = utils.read_list_of_languages(os.getcwd() + "/list_of_languages.txt")
+		first_or_all = "first language" if args.first_language else "all languages"
+		ordered_languages = language_registry.load_ordered_languages(etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages)
+		classifier = SubjectivityClassifier.train(subjective_content, objective_content, etym_dict, utils.ACCEPTABLE_MODIFIERS, list_of_languages,
+			set(stopwords.words('english')), not args.no_stopwords, args.freq_or_count, first_or_all, args.backend, ordered_languages, args.lemmatize)
+		classifier.save(args.model_file)
+		print "Saved the classifier to %s" % args.model_file
+	else:
+		classifier = SubjectivityClassifier.load(args.model_file)
+		if args.sentences_file:
+			sentences = open(args.sentences_file).readlines()
+		else:
+			sentences = sys.stdin.readlines()
+		for sentence, label in zip(sentences, classifier.predict_batch(sentences)):
+			print "%s\t%s" % (label, sentence.rstrip())